@@ -0,0 +1,4 @@
+"""Benchmarks for the email composer engine, run against local Gemini and SMTP stand-ins.
+
+Run with ``python -m benchmarks.run`` from the repository root.
+"""
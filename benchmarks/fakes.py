@@ -0,0 +1,217 @@
+"""Local stand-ins for the Gemini API and an SMTP server, so benchmarks need no network or credentials."""
+import json
+import re
+import time
+import random
+import threading
+import socketserver
+import http.server
+
+DRAFT_ID_PATTERN = re.compile(r"=== DRAFT (\S+) ===")
+
+class FakeGeminiServer:
+    """generateContent / streamGenerateContent (and /v1/completions) with configurable latency and payloads"""
+    def __init__(self, latency=0.05, jitter=0.0, issues=("Greeting does not match the recipient name",),
+                 fail_every=0, body_paragraphs=3, stream_chunk=24):
+        # Delay before every reply, plus up to jitter seconds of random extra delay
+        self.latency = latency
+        self.jitter = jitter
+        
+        # Every draft is reported with these issues (none means every draft passes)
+        self.issues = list(issues)
+        
+        # Reply with 503 to every fail_every-th request (0 never fails)
+        self.fail_every = fail_every
+        
+        # Size of refined bodies, and characters per streamed fragment
+        self.body_paragraphs = body_paragraphs
+        self.stream_chunk = stream_chunk
+        
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), self.handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+    
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v1beta"
+    
+    @property
+    def local_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+    
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="fake-gemini", daemon=True)
+        self.thread.start()
+        return self
+    
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+    
+    def reply_text(self, prompt, schema):
+        """Reply shaped like the response schema the prompt was sent with"""
+        verdict = "not ok" if self.issues else "yes"
+        properties = (schema or {}).get("properties", {})
+        if "results" in properties:
+            return json.dumps({"results": [{"id": draft_id, "verdict": verdict, "issues": self.issues}
+                                           for draft_id in DRAFT_ID_PATTERN.findall(prompt)]})
+        
+        reply = {}
+        if "verdict" in properties or not properties:
+            reply.update(verdict=verdict, issues=self.issues)
+        if "body" in properties or not properties:
+            paragraphs = ["Dear Bob,"]
+            for number in range(self.body_paragraphs):
+                paragraphs.append(f"This is paragraph {number + 1} of the refined email, "
+                                  "with a few sentences of ordinary business text.")
+            paragraphs.append("- first point\n- second point")
+            paragraphs.append("1. step one\n2. step two")
+            paragraphs.append("Best regards,\nAlice")
+            reply.update(subject="Refined subject", body="\n\n".join(paragraphs))
+        return json.dumps(reply)
+    
+    def handler_class(self):
+        fake = self
+        
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                with fake.lock:
+                    fake.requests += 1
+                    failing = fake.fail_every and fake.requests % fake.fail_every == 0
+                time.sleep(fake.latency + random.uniform(0, fake.jitter))
+                
+                if failing:
+                    self.send_json(503, {"error": {"code": 503, "message": "The model is overloaded."}})
+                elif self.path.startswith("/v1/completions"):
+                    prompts = request.get("prompt") or []
+                    if isinstance(prompts, str):
+                        prompts = [prompts]
+                    self.send_json(200, {"choices": [{"index": index, "text": fake.reply_text(prompt, None)}
+                                                     for index, prompt in enumerate(prompts)]})
+                else:
+                    prompt = request["contents"][0]["parts"][0]["text"]
+                    schema = request.get("generationConfig", {}).get("responseSchema")
+                    text = fake.reply_text(prompt, schema)
+                    if ":streamGenerateContent" in self.path:
+                        self.send_stream(text)
+                    else:
+                        self.send_json(200, {"candidates": [{"content": {"parts": [{"text": text}]}}]})
+            
+            def send_json(self, status, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def send_stream(self, text):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                for start in range(0, len(text), fake.stream_chunk):
+                    event = {"candidates": [{"content": {"parts": [{"text": text[start:start + fake.stream_chunk]}]}}]}
+                    try:
+                        # Raw UTF-8 like the real endpoint, so a client decoding it as Latin-1 shows up
+                        self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\r\n\r\n".encode("utf-8"))
+                    except OSError:
+                        return
+                self.close_connection = True
+            
+            def log_message(self, *args):
+                pass
+        
+        return Handler
+
+QT_BLOCK_STYLE = ("margin-top:0px; margin-bottom:0px; margin-left:0px; margin-right:0px; "
+                  "-qt-block-indent:0; text-indent:0px;")
+
+def qt_html(paragraphs=10, bold_every=4, list_every=7):
+    """Rich-text body in the shape QTextEdit.toHtml() writes for a draft typed in the composer"""
+    blocks = []
+    for number in range(paragraphs):
+        if list_every and number % list_every == list_every - 1:
+            items = "\n".join(f'<li style=" {QT_BLOCK_STYLE}">Point {item} of list {number}</li>' for item in range(3))
+            blocks.append('<ul style="margin-top: 0px; margin-bottom: 0px; margin-left: 0px; margin-right: 0px; '
+                          f'-qt-list-indent: 1;">{items}</ul>')
+            continue
+        text = f"This is paragraph {number} of the draft, with a few sentences of ordinary business text."
+        if bold_every and number % bold_every == 0:
+            text = f'<span style=" font-weight:600;">Note:</span> {text}'
+        blocks.append(f'<p style=" {QT_BLOCK_STYLE}">{text}</p>')
+        blocks.append(f'<p style="-qt-paragraph-type:empty; {QT_BLOCK_STYLE}"><br /></p>')
+    return ('<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.0//EN" "http://www.w3.org/TR/REC-html40/strict.dtd">\n'
+            '<html><head><meta name="qrichtext" content="1" /><style type="text/css">\n'
+            'p, li { white-space: pre-wrap; }\n'
+            '</style></head><body style=" font-family:\'Segoe UI\'; font-size:10pt; font-weight:400; font-style:normal;">\n'
+            + "\n".join(blocks) + "</body></html>")
+
+class SMTPSink:
+    """Minimal SMTP server that accepts every message and only counts what it receives"""
+    def __init__(self):
+        self.messages = 0
+        self.bytes_received = 0
+        self.lock = threading.Lock()
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), self.handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+    
+    @property
+    def port(self):
+        return self.server.server_address[1]
+    
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="smtp-sink", daemon=True)
+        self.thread.start()
+        return self
+    
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+    
+    def handler_class(self):
+        sink = self
+        
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(line.encode("ascii") + b"\r\n")
+            
+            def handle(self):
+                self.reply("220 localhost SMTP sink ready")
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line[:4].upper()
+                    if command in (b"EHLO", b"HELO"):
+                        self.wfile.write(b"250-localhost\r\n250-8BITMIME\r\n250 SIZE 0\r\n")
+                    elif command == b"DATA":
+                        self.reply("354 End data with <CR><LF>.<CR><LF>")
+                        self.receive_data()
+                        self.reply("250 OK: queued")
+                    elif command == b"QUIT":
+                        self.reply("221 Bye")
+                        return
+                    else:
+                        # MAIL, RCPT, RSET, NOOP and anything else
+                        self.reply("250 OK")
+            
+            def receive_data(self):
+                received = 0
+                while True:
+                    line = self.rfile.readline()
+                    if not line or line == b".\r\n":
+                        break
+                    received += len(line)
+                with sink.lock:
+                    sink.messages += 1
+                    sink.bytes_received += received
+        
+        return Handler
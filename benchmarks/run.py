@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""Scripted benchmark scenarios against the local Gemini and SMTP stand-ins.
+
+    python -m benchmarks.run                      # all scenarios
+    python -m benchmarks.run validate batch --latency 0.2 --json results.json
+
+Each scenario runs in its own process so that its peak RSS is measured in isolation.
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import email_core
+from benchmarks.fakes import FakeGeminiServer, SMTPSink, qt_html
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None where it cannot be measured"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def summarise(name, latencies, elapsed, unit="ops", extra=None):
+    latencies = sorted(latencies)
+    result = {
+        'scenario': name,
+        'operations': len(latencies),
+        'seconds': round(elapsed, 3),
+        'throughput': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'unit': unit,
+        'p50_ms': None, 'p95_ms': None, 'p99_ms': None,
+    }
+    for key, fraction in (('p50_ms', 0.50), ('p95_ms', 0.95), ('p99_ms', 0.99)):
+        value = percentile(latencies, fraction)
+        result[key] = round(value * 1000, 2) if value is not None else None
+    result.update(extra or {})
+    return result
+
+def make_engine(fake, args, cache_dir):
+    engine = email_core.EmailEngine("benchmark", cache_path=os.path.join(cache_dir, "cache.sqlite3"),
+                                    provider=email_core.GeminiClient("benchmark", base_url=fake.base_url,
+                                                                     pool_size=args.workers))
+    # Unlimited rate: the benchmark measures the client, not the quota
+    engine.governor = email_core.RequestGovernor()
+    return engine
+
+def draft(number, paragraphs=2):
+    body = "\n\n".join(f"Hello Bob, this is paragraph {index} of draft {number}, "
+                       "asking about the meeting next week." for index in range(paragraphs))
+    return {'id': str(number), 'to': "Bob <bob@example.com>", 'subject': f"Meeting notes {number}",
+            'body': body, 'attachments': []}
+
+def scenario_validate(args, fake, work_dir):
+    """Single validation of a fresh draft, as the Validate button does (streamed, stop on pass)"""
+    engine = make_engine(fake, args, work_dir)
+    latencies = []
+    start = time.perf_counter()
+    for number in range(args.iterations):
+        item = draft(number)
+        begin = time.perf_counter()
+        result = engine.validate_semantic(item['to'], item['subject'], item['body'], [],
+                                          progress_callback=lambda fragment: None, stop_on_pass=True)
+        latencies.append(time.perf_counter() - begin)
+        assert result.error is None, result.error
+    elapsed = time.perf_counter() - start
+    engine.close()
+    return summarise("validate", latencies, elapsed, "validations")
+
+def scenario_validate_refine(args, fake, work_dir):
+    """Validation followed by refinement, parse_refined_content and text_to_html"""
+    engine = make_engine(fake, args, work_dir)
+    latencies = []
+    start = time.perf_counter()
+    for number in range(args.iterations):
+        item = draft(number)
+        begin = time.perf_counter()
+        validation = engine.validate(item['to'], item['subject'], item['body'], [])
+        refined = engine.refine_result(item['to'], item['subject'], item['body'], validation)
+        engine.parse_refined_content(refined, "")
+        latencies.append(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - start
+    engine.close()
+    return summarise("validate_refine", latencies, elapsed, "drafts")
+
+def scenario_batch(args, fake, work_dir):
+    """Headless batch validation of many drafts, as `email_composer.py batch` runs it"""
+    engine = make_engine(fake, args, work_dir)
+    group_size = max(1, args.micro_batch)
+    engine.batch_sizer = email_core.BatchSizer(initial=min(4, group_size), maximum=group_size)
+    drafts = [draft(number) for number in range(args.drafts)]
+    groups = [drafts[index:index + group_size] for index in range(0, len(drafts), group_size)]
+    
+    latencies = []
+    def timed(group):
+        begin = time.perf_counter()
+        results = email_core.process_draft_batch(engine, group)
+        # Every draft in a group finishes when its group does
+        latencies.extend([time.perf_counter() - begin] * len(group))
+        return results
+    
+    requests_before = fake.requests
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        results = [result for group in executor.map(timed, groups) for result in group]
+    elapsed = time.perf_counter() - start
+    engine.close()
+    errors = sum(1 for result in results if result['verdict'] == "error")
+    return summarise("batch", latencies, elapsed, "drafts",
+                     {'requests': fake.requests - requests_before, 'errors': errors})
+
+def scenario_mailbox(args, fake, work_dir):
+    """Batch loading and validation of .eml files and an mbox with RFC 2047 and raw 8-bit headers"""
+    engine = make_engine(fake, args, work_dir)
+    eml_dir = os.path.join(work_dir, "eml")
+    os.makedirs(eml_dir)
+    mbox_path = os.path.join(work_dir, "drafts.mbox")
+    with open(mbox_path, "wb") as mbox:
+        for number in range(args.iterations):
+            if number % 2:
+                # Raw UTF-8 in the headers, as many clients still write them
+                headers = f"To: Jürgen <jurgen@example.com>\nSubject: Grüße {number}\n"
+            else:
+                headers = f"To: =?utf-8?q?J=C3=BCrgen?= <jurgen@example.com>\nSubject: =?utf-8?q?Gr=C3=BC=C3=9Fe_{number}?=\n"
+            raw = (headers + "Content-Type: text/plain; charset=utf-8\nContent-Transfer-Encoding: 8bit\n\n"
+                   f"Hello Jürgen, this is draft {number}.\n").encode("utf-8")
+            with open(os.path.join(eml_dir, f"{number:05d}.eml"), "wb") as file:
+                file.write(raw)
+            mbox.write(b"From alice@example.com Thu Jan  1 00:00:00 2026\n" + raw + b"\n")
+    
+    latencies = []
+    start = time.perf_counter()
+    for source in (eml_dir, mbox_path):
+        for item in email_core.load_drafts(source):
+            assert item['subject'].startswith("Grüße "), item['subject']
+            assert item['to'].startswith("Jürgen"), item['to']
+            begin = time.perf_counter()
+            result = email_core.process_draft(engine, item)
+            json.dumps(result, ensure_ascii=False)
+            latencies.append(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - start
+    engine.close()
+    return summarise("mailbox", latencies, elapsed, "drafts")
+
+def scenario_attachment(args, fake, work_dir):
+    """Send of one message with a large attachment, streamed into the SMTP DATA phase"""
+    sink = SMTPSink().start()
+    path = os.path.join(work_dir, "attachment.bin")
+    block = os.urandom(1024 * 1024)
+    with open(path, "wb") as file:
+        for _ in range(args.attachment_mb):
+            file.write(block)
+    
+    manager = email_core.SMTPConnectionManager("127.0.0.1", sink.port, "", "", use_starttls=False)
+    latencies = []
+    start = time.perf_counter()
+    for number in range(args.sends):
+        message = email_core.StreamingMIMEMessage("alice@example.com", "bob@example.com",
+                                                  f"Large attachment {number}", "<p>See attached.</p>", [path])
+        begin = time.perf_counter()
+        manager.send_streaming(message)
+        latencies.append(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - start
+    manager.close()
+    sink.stop()
+    megabytes = sink.bytes_received / (1024 * 1024)
+    return summarise("attachment", latencies, elapsed, "sends",
+                     {'wire_mb': round(megabytes, 1), 'mb_per_second': round(megabytes / elapsed, 1)})
+
+def scenario_outbound_html(args, fake, work_dir):
+    """Size of typical drafts as sent (compacted HTML plus text alternative) against the raw editor HTML"""
+    sink = SMTPSink().start()
+    manager = email_core.SMTPConnectionManager("127.0.0.1", sink.port, "", "", use_starttls=False)
+    raw_html = compact_html = raw_message = compact_message = 0
+    latencies = []
+    start = time.perf_counter()
+    for number in range(args.iterations):
+        # Drafts from a few lines to a few pages
+        body_html = qt_html(paragraphs=3 + number % 40)
+        raw = email_core.StreamingMIMEMessage("alice@example.com", "bob@example.com", "Draft", body_html, [],
+                                              compact=False)
+        raw_html += len(body_html.encode("utf-8"))
+        raw_message += sum(len(chunk) for chunk in raw.iter_chunks())
+        
+        begin = time.perf_counter()
+        message = email_core.StreamingMIMEMessage("alice@example.com", "bob@example.com", "Draft", body_html, [])
+        manager.send_streaming(message)
+        latencies.append(time.perf_counter() - begin)
+        compact_html += len(message.body_html.encode("utf-8"))
+        compact_message += sum(len(chunk) for chunk in message.iter_chunks())
+    elapsed = time.perf_counter() - start
+    manager.close()
+    sink.stop()
+    return summarise("outbound_html", latencies, elapsed, "sends", {
+        'html_kb': f"{raw_html / 1024:.1f}->{compact_html / 1024:.1f}",
+        'message_kb': f"{raw_message / 1024:.1f}->{compact_message / 1024:.1f}",
+        'html_reduction_pct': round(100 * (1 - compact_html / raw_html), 1),
+        'message_reduction_pct': round(100 * (1 - compact_message / raw_message), 1),
+    })
+
+def scenario_text_to_html(args, fake, work_dir):
+    """Conversion of a long refined body to HTML (no network)"""
+    engine = make_engine(fake, args, work_dir)
+    paragraphs = []
+    for number in range(args.paragraphs):
+        if number % 10 == 3:
+            paragraphs.append("- first point\n- second point\n- third point")
+        elif number % 10 == 7:
+            paragraphs.append("1. step one\n2. step two\n   - detail a\n   - detail b\n10. step ten")
+        else:
+            paragraphs.append(f"Paragraph {number} with <some> & ordinary text.\nIt has a second line.")
+    text = "\n\n".join(paragraphs)
+    
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(args.iterations):
+        begin = time.perf_counter()
+        engine.text_to_html(text, "")
+        latencies.append(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - start
+    engine.close()
+    return summarise("text_to_html", latencies, elapsed, "conversions", {'paragraphs': args.paragraphs})
+
+SCENARIOS = {
+    'validate': scenario_validate,
+    'validate_refine': scenario_validate_refine,
+    'batch': scenario_batch,
+    'mailbox': scenario_mailbox,
+    'attachment': scenario_attachment,
+    'outbound_html': scenario_outbound_html,
+    'text_to_html': scenario_text_to_html,
+}
+
+def run_scenario(name, args):
+    """Run one scenario in this process and return its result"""
+    fake = FakeGeminiServer(latency=args.latency, jitter=args.jitter, fail_every=args.fail_every).start()
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            result = SCENARIOS[name](args, fake, work_dir)
+    finally:
+        fake.stop()
+    peak = peak_rss_mb()
+    result['peak_rss_mb'] = round(peak, 1) if peak is not None else None
+    return result
+
+def print_table(results):
+    columns = ['scenario', 'operations', 'seconds', 'throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'peak_rss_mb']
+    print("  ".join(f"{column:>14}" for column in columns))
+    for result in results:
+        print("  ".join(f"{str(result.get(column, '')):>14}" for column in columns))
+        details = {key: value for key, value in result.items() if key not in columns + ['unit']}
+        if details:
+            print(f"{'':>14}  " + ", ".join(f"{key}={value}" for key, value in details.items()))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the email composer engine against local stand-ins.")
+    parser.add_argument("scenarios", nargs="*",
+                        help=f"scenarios to run: {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake Gemini reply latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra latency in seconds")
+    parser.add_argument("--fail-every", type=int, default=0, help="answer every Nth request with a 503")
+    parser.add_argument("--iterations", type=int, default=50, help="repetitions of the single-draft scenarios")
+    parser.add_argument("--drafts", type=int, default=1000, help="drafts in the batch scenario")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent workers in the batch scenario")
+    parser.add_argument("--micro-batch", type=int, default=0, help="drafts per request in the batch scenario")
+    parser.add_argument("--attachment-mb", type=int, default=100, help="attachment size in the send scenario")
+    parser.add_argument("--sends", type=int, default=1, help="messages sent in the attachment scenario")
+    parser.add_argument("--paragraphs", type=int, default=10000, help="paragraphs in the text_to_html scenario")
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    parser.add_argument("--in-process", action="store_true",
+                        help="run every scenario in this process (peak RSS is then cumulative)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario: {', '.join(unknown)}")
+    
+    if args.child:
+        print(json.dumps(run_scenario(args.child, args)))
+        return 0
+    
+    results = []
+    for name in args.scenarios or list(SCENARIOS):
+        if args.in_process:
+            results.append(run_scenario(name, args))
+            continue
+        forwarded = [argument for argument in (argv if argv is not None else sys.argv[1:])
+                     if argument not in SCENARIOS]
+        completed = subprocess.run([sys.executable, "-m", "benchmarks.run", "--child", name] + forwarded,
+                                   capture_output=True, text=True,
+                                   cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        if completed.returncode != 0:
+            print(f"{name} failed:\n{completed.stderr}", file=sys.stderr)
+            return 1
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    
+    print_table(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2601 @@
+#!/usr/bin/env python3
+"""GUI-independent core of the email composer: Gemini client, caching, prompts, SMTP delivery and batch mode.
+
+Nothing in this module imports PyQt, so it can be used from worker processes,
+servers and the command line without a display.
+"""
+import sys
+import os
+import json
+import time
+import threading
+import hashlib
+import random
+import sqlite3
+import uuid
+import base64
+import re
+import smtplib
+import textwrap
+import difflib
+import quopri
+import html as html_lib
+from collections import deque, OrderedDict
+import email.policy
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid, getaddresses
+from email import message_from_binary_file
+from html.parser import HTMLParser
+
+# Per-user application data (response cache, outbox, ...)
+APP_DATA_DIR = os.path.join(os.path.expanduser("~"), ".email_composer")
+
+class TaskCancelled(Exception):
+    """Raised inside a worker when its task has been cancelled"""
+
+class APIError(RuntimeError):
+    """Error reply from a model API; retry_after is the server's requested delay in seconds, if any"""
+    RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+    
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+    
+    @property
+    def retryable(self):
+        return self.status in self.RETRYABLE_STATUSES
+    
+    @classmethod
+    def from_response(cls, response):
+        """Build the error from a non-200 response, reading Retry-After or the RetryInfo detail"""
+        try:
+            error = response.json().get('error', {})
+        except ValueError:
+            error = {}
+        retry_after = None
+        header = response.headers.get('Retry-After')
+        if header:
+            try:
+                retry_after = float(header)
+            except ValueError:
+                from email.utils import parsedate_to_datetime
+                try:
+                    retry_after = max(0.0, parsedate_to_datetime(header).timestamp() - time.time())
+                except (TypeError, ValueError):
+                    retry_after = None
+        for detail in error.get('details') or []:
+            delay = detail.get('retryDelay')
+            if retry_after is None and isinstance(delay, str) and delay.endswith("s"):
+                try:
+                    retry_after = float(delay[:-1])
+                except ValueError:
+                    pass
+        return cls(error.get('message') or f"HTTP {response.status_code}", response.status_code, retry_after)
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling the API while the circuit breaker is open"""
+
+class Span:
+    """One timed stage of work; spans opened inside it on the same thread become its children"""
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start_time = time.time()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.error = None
+    
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+    
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': round(self.start_time, 6),
+            'duration_ms': round(self.duration * 1000, 3),
+            'thread': threading.current_thread().name,
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+class SpanContext:
+    """Context manager returned by Tracer.span"""
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.span = None
+    
+    def __enter__(self):
+        self.span = self.tracer.start_span(self.name, self.attributes)
+        return self.span
+    
+    def __exit__(self, exc_type, exc, traceback):
+        if exc is not None and not isinstance(exc, TaskCancelled):
+            self.span.error = f"{exc_type.__name__}: {exc}"
+        self.tracer.end_span(self.span)
+        return False
+
+class Tracer:
+    """Span-based timing of the hot paths, with per-stage statistics, counters, a JSONL log and exporters"""
+    def __init__(self, log_path=None, max_log_bytes=5 * 1024 * 1024, history=50):
+        # Optional JSONL trace log, rotated to <path>.1 when it grows past max_log_bytes
+        self.log_path = log_path
+        self.max_log_bytes = max_log_bytes
+        
+        # Recent durations per stage, and free-form counters
+        self.history = history
+        self.stages = {}
+        self.counters = {}
+        
+        # Objects with start(span) and end(span), e.g. OpenTelemetryExporter
+        self.exporters = []
+        
+        self.local = threading.local()
+        self.lock = threading.Lock()
+    
+    def span(self, name, **attributes):
+        """Time a block: with TRACER.span("smtp.login"): ..."""
+        return SpanContext(self, name, attributes)
+    
+    def start_span(self, name, attributes=None):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        parent = stack[-1] if stack else None
+        span = Span(name, parent.trace_id if parent else uuid.uuid4().hex, parent.span_id if parent else None,
+                    attributes)
+        stack.append(span)
+        for exporter in self.exporters:
+            exporter.start(span)
+        return span
+    
+    def end_span(self, span):
+        span.duration = time.perf_counter() - span.start
+        stack = getattr(self.local, 'stack', [])
+        if span in stack:
+            stack.remove(span)
+        
+        with self.lock:
+            stage = self.stages.get(span.name)
+            if stage is None:
+                stage = self.stages[span.name] = {'count': 0, 'errors': 0, 'durations': deque(maxlen=self.history)}
+            stage['count'] += 1
+            stage['errors'] += span.error is not None
+            stage['durations'].append(span.duration)
+            if self.log_path:
+                self.write_log(span)
+        for exporter in self.exporters:
+            exporter.end(span)
+    
+    def write_log(self, span):
+        try:
+            if os.path.exists(self.log_path) and os.path.getsize(self.log_path) > self.max_log_bytes:
+                os.replace(self.log_path, self.log_path + ".1")
+            with open(self.log_path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(span.to_dict(), default=str) + "\n")
+        except OSError:
+            # Tracing must never break the traced operation
+            self.log_path = None
+    
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+    
+    def stats(self):
+        """Per-stage count, errors and last/p50/p95 duration in ms over recent spans, plus the counters"""
+        with self.lock:
+            stages = {}
+            for name, stage in self.stages.items():
+                durations = sorted(stage['durations'])
+                stages[name] = {
+                    'count': stage['count'],
+                    'errors': stage['errors'],
+                    'last_ms': round(stage['durations'][-1] * 1000, 1),
+                    'p50_ms': round(durations[len(durations) // 2] * 1000, 1),
+                    'p95_ms': round(durations[min(len(durations) - 1, int(len(durations) * 0.95))] * 1000, 1),
+                }
+            return {'stages': stages, 'counters': dict(self.counters)}
+
+class OpenTelemetryExporter:
+    """Mirrors spans into OpenTelemetry (requires the opentelemetry-api/sdk packages and a configured provider)"""
+    def __init__(self, service_name="email-composer"):
+        from opentelemetry import trace
+        self.trace = trace
+        self.otel_tracer = trace.get_tracer(service_name)
+        self.spans = {}
+        self.lock = threading.Lock()
+    
+    def start(self, span):
+        with self.lock:
+            parent = self.spans.get(span.parent_id)
+        context = self.trace.set_span_in_context(parent) if parent is not None else None
+        otel_span = self.otel_tracer.start_span(span.name, context=context, start_time=int(span.start_time * 1e9))
+        with self.lock:
+            self.spans[span.span_id] = otel_span
+    
+    def end(self, span):
+        with self.lock:
+            otel_span = self.spans.pop(span.span_id, None)
+        if otel_span is None:
+            return
+        for key, value in span.attributes.items():
+            otel_span.set_attribute(key, value if isinstance(value, (str, bool, int, float)) else str(value))
+        if span.error is not None:
+            otel_span.set_status(self.trace.Status(self.trace.StatusCode.ERROR, span.error))
+        otel_span.end(end_time=int((span.start_time + span.duration) * 1e9))
+
+# Process-wide tracer used by the engine, SMTP delivery and the GUI
+TRACER = Tracer()
+
+class LLMProvider:
+    """Interface of the model backends used by EmailEngine, with shared latency bookkeeping"""
+    # Whether the engine may pick the model per call (see ModelRouter)
+    routable = False
+    
+    def __init__(self, model):
+        self.model = model
+        
+        # Recent request latencies in seconds
+        self.latencies = deque(maxlen=100)
+        self.lock = threading.Lock()
+    
+    def generate(self, prompt, generation_config=None, model=None):
+        """Return the reply text for one prompt, or None"""
+        raise NotImplementedError
+    
+    def stream_generate(self, prompt, generation_config=None, model=None):
+        """Yield the reply in fragments; backends without streaming yield it whole"""
+        text = self.generate(prompt, generation_config, model)
+        if text:
+            yield text
+    
+    def record_latency(self, seconds):
+        with self.lock:
+            self.latencies.append(seconds)
+    
+    def last_latency(self):
+        with self.lock:
+            return self.latencies[-1] if self.latencies else None
+    
+    def average_latency(self):
+        with self.lock:
+            return sum(self.latencies) / len(self.latencies) if self.latencies else None
+    
+    def close(self):
+        pass
+
+class GeminiClient(LLMProvider):
+    """Keep-alive HTTP client for the Gemini generateContent API"""
+    BASE_URL = "https://generativelanguage.googleapis.com/v1beta"
+    routable = True
+    
+    def __init__(self, api_key, model="gemini-2.0-flash", base_url=None,
+                 connect_timeout=5.0, read_timeout=60.0, pool_size=4):
+        super().__init__(model)
+        self.api_key = api_key
+        self.base_url = (base_url or self.BASE_URL).rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        
+        # Imported here so that loading the core stays fast when no client is needed
+        import requests
+        from requests.adapters import HTTPAdapter
+        
+        # One session keeps TCP/TLS connections alive between calls
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # The key goes in a header, not the query string, so it never appears in URLs quoted by
+        # connection errors (which end up in traces and batch results)
+        self.session.headers.update({'Content-Type': 'application/json', 'x-goog-api-key': api_key or ""})
+        
+    def url(self, method, model=None):
+        return f"{self.base_url}/models/{model or self.model}:{method}"
+    
+    @staticmethod
+    def request_body(prompt, generation_config=None):
+        data = {
+            "contents": [{
+                "parts": [{"text": prompt}]
+            }]
+        }
+        if generation_config:
+            data["generationConfig"] = generation_config
+        return data
+    
+    def generate(self, prompt, generation_config=None, model=None):
+        """Send a single prompt and return the text of the first candidate, or None"""
+        data = self.request_body(prompt, generation_config)
+        
+        start = time.perf_counter()
+        try:
+            with TRACER.span("gemini.http", model=model or self.model) as span:
+                response = self.session.post(self.url("generateContent", model),
+                                             json=data, timeout=self.timeout)
+                span.set(status=response.status_code, response_bytes=len(response.content))
+            if response.status_code != 200:
+                raise APIError.from_response(response)
+            with TRACER.span("gemini.json_decode"):
+                response_json = response.json()
+        finally:
+            self.record_latency(time.perf_counter() - start)
+        
+        if 'error' in response_json:
+            raise APIError(response_json['error'].get('message', 'Unknown Gemini error'),
+                                 response_json['error'].get('code'))
+        
+        candidates = response_json.get('candidates') or []
+        if candidates and 'parts' in candidates[0].get('content', {}):
+            return candidates[0]['content']['parts'][0]['text']
+        return None
+    
+    def stream_generate(self, prompt, generation_config=None, model=None):
+        """Yield text fragments as the model produces them via the streamGenerateContent SSE endpoint"""
+        data = self.request_body(prompt, generation_config)
+        
+        start = time.perf_counter()
+        span = TRACER.start_span("gemini.stream", {'model': model or self.model})
+        fragments = 0
+        try:
+            response = self.session.post(self.url("streamGenerateContent", model),
+                                         params={'alt': 'sse'},
+                                         json=data, timeout=self.timeout, stream=True)
+            span.set(status=response.status_code)
+        except Exception as e:
+            span.error = str(e)
+            TRACER.end_span(span)
+            raise
+        try:
+            if response.status_code != 200:
+                raise APIError.from_response(response)
+            
+            # SSE is always UTF-8; without a charset in the Content-Type requests would assume ISO-8859-1
+            response.encoding = "utf-8"
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                event = json.loads(line[5:])
+                candidates = event.get('candidates') or []
+                if candidates:
+                    for part in candidates[0].get('content', {}).get('parts', []):
+                        if part.get('text'):
+                            if not fragments:
+                                span.set(first_fragment_ms=round((time.perf_counter() - start) * 1000, 1))
+                            fragments += 1
+                            yield part['text']
+        except GeneratorExit:
+            raise
+        except Exception as e:
+            span.error = str(e)
+            raise
+        finally:
+            # Closing early (cancel or early stop) drops the connection instead of draining it
+            response.close()
+            self.record_latency(time.perf_counter() - start)
+            span.set(fragments=fragments)
+            TRACER.end_span(span)
+    
+    def close(self):
+        self.session.close()
+
+# Markdown code fences that small local models tend to wrap JSON in
+CODE_FENCE_PATTERN = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$")
+
+class LocalCompletionProvider(LLMProvider):
+    """Local or LAN server with an OpenAI-compatible /v1/completions endpoint (llama.cpp, vLLM, Ollama, ...)
+
+    Concurrent generate() calls are collected into one request with a list of prompts.
+    """
+    def __init__(self, base_url="http://127.0.0.1:8080/v1", model="local", api_key=None,
+                 max_batch=8, batch_window=0.01, max_tokens=1024, connect_timeout=2.0, read_timeout=120.0):
+        super().__init__(model)
+        self.base_url = base_url.rstrip("/")
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.max_tokens = max_tokens
+        self.timeout = (connect_timeout, read_timeout)
+        
+        import requests
+        self.session = requests.Session()
+        self.session.headers.update({'Content-Type': 'application/json'})
+        if api_key:
+            self.session.headers['Authorization'] = f"Bearer {api_key}"
+        
+        # Requests waiting for the batching thread
+        self.pending = deque()
+        self.condition = threading.Condition()
+        self.batcher = None
+        self.closed = False
+    
+    @staticmethod
+    def prompt_text(prompt, generation_config=None):
+        # Completion servers do not all accept a response schema, so it is stated in the prompt
+        schema = (generation_config or {}).get("responseSchema")
+        if schema is None:
+            return prompt
+        return (prompt + "\n\nRespond with a single JSON object and nothing else, matching this schema:\n"
+                + json.dumps(schema))
+    
+    def generate(self, prompt, generation_config=None, model=None):
+        request = {'prompt': self.prompt_text(prompt, generation_config), 'done': threading.Event(),
+                   'result': None, 'error': None}
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("Local model provider is closed")
+            self.pending.append(request)
+            if self.batcher is None:
+                self.batcher = threading.Thread(target=self.run, name="local-model-batcher", daemon=True)
+                self.batcher.start()
+            self.condition.notify()
+        request['done'].wait()
+        if request['error'] is not None:
+            raise request['error']
+        return request['result']
+    
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if self.closed and not self.pending:
+                    return
+            # Give concurrent callers a moment to join the batch; more arrive while a batch is in flight
+            time.sleep(self.batch_window)
+            with self.condition:
+                batch = [self.pending.popleft() for _ in range(min(self.max_batch, len(self.pending)))]
+            self.send_batch(batch)
+    
+    def send_batch(self, batch):
+        start = time.perf_counter()
+        try:
+            response = self.session.post(f"{self.base_url}/completions", json={
+                "model": self.model,
+                "prompt": [request['prompt'] for request in batch],
+                "max_tokens": self.max_tokens,
+                "temperature": 0,
+            }, timeout=self.timeout)
+            if response.status_code != 200:
+                raise APIError.from_response(response)
+            for choice in response.json().get('choices') or []:
+                index = choice.get('index', 0)
+                if 0 <= index < len(batch):
+                    text = CODE_FENCE_PATTERN.sub("", choice.get('text') or "")
+                    batch[index]['result'] = text.strip() or None
+        except Exception as e:
+            for request in batch:
+                request['error'] = e
+        finally:
+            self.record_latency(time.perf_counter() - start)
+            for request in batch:
+                request['done'].set()
+    
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.session.close()
+
+def create_provider(name, api_key=None, base_url=None, model=None):
+    """Build the model backend named in the configuration (gemini or local)"""
+    if name == "gemini":
+        return GeminiClient(api_key, model=model or "gemini-2.0-flash", base_url=base_url)
+    if name == "local":
+        return LocalCompletionProvider(base_url or "http://127.0.0.1:8080/v1", model=model or "local",
+                                       api_key=api_key)
+    raise ValueError(f"Unknown model provider: {name}")
+
+class RequestGovernor:
+    """Client-side limits for Gemini calls: token bucket, retries with jittered backoff and a circuit breaker"""
+    def __init__(self, per_minute=None, burst=None, max_retries=4, base_delay=1.0, max_delay=60.0,
+                 failure_threshold=5, reset_timeout=30.0):
+        # Token bucket matching the API quota; None disables throttling
+        self.per_minute = per_minute
+        self.capacity = burst or (max(1.0, per_minute / 6.0) if per_minute else 1.0)
+        self.tokens = self.capacity
+        self.refilled = time.monotonic()
+        
+        # A 429 pauses every caller, not just the one that received it
+        self.paused_until = 0.0
+        
+        # Retries of 429/5xx replies and connection failures
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        
+        # Consecutive failures that open the circuit, and how long it stays open before a probe
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        
+        # Statistics
+        self.waiting = 0
+        self.throttled = 0
+        self.throttle_seconds = 0.0
+        self.retries = 0
+        self.rejected = 0
+        
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        """Block until the bucket has a token (and any 429 pause is over)"""
+        with self.lock:
+            self.waiting += 1
+        waited = 0.0
+        try:
+            while True:
+                with self.lock:
+                    now = time.monotonic()
+                    delay = self.paused_until - now
+                    if delay <= 0 and self.per_minute:
+                        self.tokens = min(self.capacity, self.tokens + (now - self.refilled) * self.per_minute / 60.0)
+                        self.refilled = now
+                        if self.tokens >= 1:
+                            self.tokens -= 1
+                        else:
+                            delay = (1 - self.tokens) * 60.0 / self.per_minute
+                    if delay <= 0:
+                        if waited:
+                            self.throttled += 1
+                            self.throttle_seconds += waited
+                            TRACER.count("gemini.throttled")
+                        return
+                time.sleep(delay)
+                waited += delay
+        finally:
+            with self.lock:
+                self.waiting -= 1
+    
+    def before_call(self):
+        # Fail fast while the circuit is open; after reset_timeout a single probe is let through
+        with self.lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0 or self.probing:
+                self.rejected += 1
+                TRACER.count("gemini.circuit_rejected")
+                raise CircuitOpenError(
+                    f"Gemini API unavailable after repeated failures; retrying in {max(remaining, 1):.0f}s")
+            self.probing = True
+    
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+    
+    def record_failure(self, retry_after=None):
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.probing = False
+            if retry_after:
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+    
+    @staticmethod
+    def is_retryable(error):
+        if isinstance(error, APIError):
+            return error.retryable
+        import requests
+        return isinstance(error, (requests.ConnectionError, requests.Timeout))
+    
+    def backoff(self, attempt, retry_after=None):
+        """Delay before the next attempt: the server's Retry-After, else full-jitter exponential backoff"""
+        if retry_after is not None:
+            return min(self.max_delay, retry_after)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+    
+    def call(self, fn, *args, **kwargs):
+        """Call fn under the rate limit, retrying transient failures"""
+        attempt = 0
+        while True:
+            self.before_call()
+            self.acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                if not self.is_retryable(e):
+                    # The API answered (or the caller gave up); the error concerns this request only
+                    self.record_success()
+                    raise
+                retry_after = getattr(e, 'retry_after', None)
+                self.record_failure(retry_after)
+                if attempt >= self.max_retries:
+                    raise
+                with self.lock:
+                    self.retries += 1
+                TRACER.count("gemini.retries")
+                time.sleep(self.backoff(attempt, retry_after))
+                attempt += 1
+            else:
+                self.record_success()
+                return result
+    
+    def state(self):
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half-open" if self.probing or time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+    
+    def stats(self):
+        state = self.state()
+        with self.lock:
+            return {
+                'queue_depth': self.waiting,
+                'throttled': self.throttled,
+                'throttle_seconds': round(self.throttle_seconds, 3),
+                'retries': self.retries,
+                'rejected': self.rejected,
+                'consecutive_failures': self.failures,
+                'circuit': state,
+            }
+
+class LatencyHistogram:
+    """Latency histogram over the most recent calls to one model, with their error rate"""
+    # Geometric bucket bounds from 50 ms to about 2 minutes
+    BOUNDS = [0.05 * 1.5 ** i for i in range(20)]
+    
+    def __init__(self, window=200):
+        self.samples = deque()
+        self.window = window
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.errors = 0
+    
+    def bucket(self, seconds):
+        for index, bound in enumerate(self.BOUNDS):
+            if seconds <= bound:
+                return index
+        return len(self.BOUNDS)
+    
+    def record(self, seconds, ok=True):
+        sample = (self.bucket(seconds), ok)
+        self.samples.append(sample)
+        self.counts[sample[0]] += 1
+        self.errors += not ok
+        if len(self.samples) > self.window:
+            index, old_ok = self.samples.popleft()
+            self.counts[index] -= 1
+            self.errors -= not old_ok
+    
+    def __len__(self):
+        return len(self.samples)
+    
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of calls, or None without samples"""
+        if not self.samples:
+            return None
+        target = fraction * len(self.samples)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return self.BOUNDS[index] if index < len(self.BOUNDS) else float("inf")
+        return float("inf")
+    
+    def error_rate(self):
+        return self.errors / len(self.samples) if self.samples else 0.0
+
+class ModelRouter:
+    """Chooses the model for each kind of task and falls back when the preferred one is slow or failing"""
+    def __init__(self, routes=None, fallbacks=None, latency_threshold=10.0, error_threshold=0.3,
+                 min_samples=5, probe_every=10, hedging=False, hedge_after=2.0):
+        # Cheap validation goes to the lite model, refinement to the stronger one
+        self.routes = routes or {
+            "validate": "gemini-2.0-flash-lite",
+            "refine": "gemini-2.0-flash",
+            "combined": "gemini-2.0-flash",
+        }
+        self.fallbacks = fallbacks or {
+            "gemini-2.0-flash-lite": "gemini-2.0-flash",
+            "gemini-2.0-flash": "gemini-2.0-flash-lite",
+        }
+        
+        # A model is unhealthy once its p95 latency or error rate crosses these
+        self.latency_threshold = latency_threshold
+        self.error_threshold = error_threshold
+        self.min_samples = min_samples
+        
+        # While falling back, every probe_every-th call still goes to the preferred model
+        # so its histogram can recover
+        self.probe_every = probe_every
+        self.fallback_calls = 0
+        
+        # Hedged requests: ask the alternate model too when the first has not answered
+        # within its p95 latency (hedge_after until there are enough samples)
+        self.hedging = hedging
+        self.hedge_after = hedge_after
+        
+        self.histograms = {}
+        self.lock = threading.Lock()
+    
+    def record(self, model, seconds, ok=True):
+        with self.lock:
+            self.histograms.setdefault(model, LatencyHistogram()).record(seconds, ok)
+    
+    def healthy(self, model):
+        with self.lock:
+            histogram = self.histograms.get(model)
+            if histogram is None or len(histogram) < self.min_samples:
+                return True
+            return (histogram.percentile(0.95) <= self.latency_threshold and
+                    histogram.error_rate() <= self.error_threshold)
+    
+    def model_for(self, task):
+        """Preferred model for the task, or its fallback while the preferred one is unhealthy"""
+        model = self.routes.get(task) or self.routes["validate"]
+        fallback = self.fallbacks.get(model)
+        if fallback and not self.healthy(model) and self.healthy(fallback):
+            with self.lock:
+                self.fallback_calls += 1
+                if self.fallback_calls % self.probe_every:
+                    return fallback
+        return model
+    
+    def hedge_for(self, model):
+        """(alternate model, delay) for a hedged request, or None when hedging is off"""
+        alternate = self.fallbacks.get(model)
+        if not self.hedging or not alternate or alternate == model:
+            return None
+        with self.lock:
+            histogram = self.histograms.get(model)
+            delay = self.hedge_after
+            if histogram is not None and len(histogram) >= self.min_samples:
+                delay = min(histogram.percentile(0.95), self.latency_threshold)
+        return alternate, delay
+    
+    def stats(self):
+        with self.lock:
+            return {model: {'calls': len(histogram),
+                            'p50': histogram.percentile(0.5),
+                            'p95': histogram.percentile(0.95),
+                            'error_rate': round(histogram.error_rate(), 3)}
+                    for model, histogram in self.histograms.items()}
+
+class ResponseCache:
+    """Two-tier (memory LRU + SQLite) cache of Gemini responses keyed on model and prompt"""
+    def __init__(self, path=None, memory_size=128, disk_size=2000, ttl=24 * 3600):
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self.ttl = ttl
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        
+        # On-disk tier is optional; pass path=None to keep everything in memory
+        self.db = None
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )
+            """)
+            self.db.commit()
+    
+    @staticmethod
+    def make_key(model, prompt):
+        return hashlib.sha256(f"{model}\n{prompt}".encode("utf-8")).hexdigest()
+    
+    def get(self, model, prompt):
+        key = self.make_key(model, prompt)
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                value, created = entry
+                if now - created < self.ttl:
+                    self.memory.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.memory[key]
+            
+            if self.db is not None:
+                row = self.db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value, created = row
+                    if now - created < self.ttl:
+                        self.db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                        self.db.commit()
+                        self.remember(key, value, created)
+                        self.hits += 1
+                        return value
+                    self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self.db.commit()
+            
+            self.misses += 1
+            return None
+    
+    def put(self, model, prompt, value):
+        key = self.make_key(model, prompt)
+        now = time.time()
+        with self.lock:
+            self.remember(key, value, now)
+            if self.db is not None:
+                self.db.execute("INSERT OR REPLACE INTO responses (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                                (key, value, now, now))
+                self.evict_disk(now)
+                self.db.commit()
+    
+    def remember(self, key, value, created):
+        # Caller holds the lock
+        self.memory[key] = (value, created)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+    
+    def evict_disk(self, now):
+        # Caller holds the lock: drop expired rows, then least recently used beyond the size bound
+        self.db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        self.db.execute("""
+            DELETE FROM responses WHERE key IN (
+                SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.disk_size,))
+    
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'memory_entries': len(self.memory)}
+    
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+class PooledSMTPConnection:
+    """An authenticated SMTP session plus the bookkeeping needed to decide when to reuse it"""
+    def __init__(self, server):
+        self.server = server
+        self.last_used = time.monotonic()
+        self.sent = 0
+        # "command" between transactions, "data" while message data is being written,
+        # "reply" once the end-of-data marker is out and the server's answer is pending
+        self.phase = "command"
+    
+    def close(self):
+        if self.phase != "command":
+            # QUIT would be read as message data (or queue behind a lost reply) and hang until the timeout
+            self.server.close()
+            return
+        try:
+            self.server.quit()
+        except (smtplib.SMTPException, OSError):
+            self.server.close()
+
+class SMTPConnectionManager:
+    """Keeps authenticated SMTP connections alive and reuses them across messages"""
+    # Bytes of message data collected before each socket write
+    WRITE_BUFFER_SIZE = 64 * 1024
+    
+    def __init__(self, host, port, username, password, use_starttls=True, pool_size=2,
+                 health_check_after=30.0, max_idle=240.0, max_messages=100, timeout=30.0):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_starttls = use_starttls
+        self.pool_size = pool_size
+        self.health_check_after = health_check_after
+        self.max_idle = max_idle
+        self.max_messages = max_messages
+        self.timeout = timeout
+        self.idle = []
+        self.lock = threading.Lock()
+    
+    def connect(self):
+        TRACER.count("smtp.connections_opened")
+        with TRACER.span("smtp.connect", host=self.host, port=self.port):
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_starttls:
+                with TRACER.span("smtp.starttls"):
+                    server.starttls()
+            if self.username:
+                with TRACER.span("smtp.login"):
+                    server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+        return PooledSMTPConnection(server)
+    
+    def is_usable(self, connection):
+        idle_for = time.monotonic() - connection.last_used
+        if idle_for > self.max_idle or connection.sent >= self.max_messages:
+            return False
+        if idle_for > self.health_check_after:
+            # Servers drop idle sessions silently; NOOP tells us before we try to send
+            try:
+                return connection.server.noop()[0] == 250
+            except (smtplib.SMTPException, OSError):
+                return False
+        return True
+    
+    def acquire(self):
+        while True:
+            with self.lock:
+                connection = self.idle.pop() if self.idle else None
+            if connection is None:
+                return self.connect()
+            if self.is_usable(connection):
+                TRACER.count("smtp.connections_reused")
+                return connection
+            connection.close()
+    
+    def release(self, connection):
+        connection.last_used = time.monotonic()
+        with self.lock:
+            if len(self.idle) < self.pool_size:
+                self.idle.append(connection)
+                return
+        connection.close()
+    
+    def send_streaming(self, message):
+        """Write a StreamingMIMEMessage straight into the DATA phase of a pooled connection"""
+        # A missing or unreadable attachment must fail here, not halfway through DATA
+        message.check_attachments()
+        for attempt in range(2):
+            connection = self.acquire()
+            try:
+                with TRACER.span("smtp.send", attempt=attempt + 1):
+                    self.stream_data(connection, message)
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                delivered_maybe = connection.phase == "reply"
+                connection.server.close()
+                # Once the end-of-data marker is out the server may have accepted the message;
+                # retrying could deliver it twice
+                if attempt or delivered_maybe:
+                    raise
+                continue
+            except Exception:
+                connection.close()
+                raise
+            connection.sent += 1
+            self.release(connection)
+            return
+    
+    @staticmethod
+    def stream_data(connection, message):
+        server = connection.server
+        with TRACER.span("smtp.envelope"):
+            SMTPConnectionManager.send_envelope(server, message)
+        connection.phase = "data"
+        
+        with TRACER.span("smtp.data") as span:
+            # MIME assembly and socket writes are interleaved, so both are timed separately
+            mime_seconds = socket_seconds = 0.0
+            sent = 0
+            # Small chunks (headers, boundaries) are coalesced into larger writes; many small writes
+            # followed by a read stall on Nagle's algorithm and delayed ACKs
+            buffer = bytearray()
+            chunks = iter(message.iter_chunks())
+            while True:
+                start = time.perf_counter()
+                chunk = next(chunks, None)
+                mime_seconds += time.perf_counter() - start
+                if chunk is None:
+                    break
+                # Dot-stuff lines that begin with "." (base64 output never does, quoted-printable text can)
+                if b"\n." in chunk or chunk.startswith(b"."):
+                    chunk = chunk.replace(b"\r\n.", b"\r\n..")
+                    if chunk.startswith(b"."):
+                        chunk = b"." + chunk
+                buffer += chunk
+                if len(buffer) >= SMTPConnectionManager.WRITE_BUFFER_SIZE:
+                    start = time.perf_counter()
+                    server.send(bytes(buffer))
+                    socket_seconds += time.perf_counter() - start
+                    sent += len(buffer)
+                    buffer.clear()
+            # The end-of-data marker goes out with the last chunk
+            sent += len(buffer)
+            buffer += b".\r\n"
+            start = time.perf_counter()
+            server.send(bytes(buffer))
+            socket_seconds += time.perf_counter() - start
+            connection.phase = "reply"
+            
+            start = time.perf_counter()
+            code, response = server.getreply()
+            connection.phase = "command"
+            span.set(bytes=sent, mime_ms=round(mime_seconds * 1000, 1), socket_ms=round(socket_seconds * 1000, 1),
+                     reply_ms=round((time.perf_counter() - start) * 1000, 1))
+        if code != 250:
+            raise smtplib.SMTPDataError(code, response)
+    
+    @staticmethod
+    def send_envelope(server, message):
+        """MAIL FROM, RCPT TO for every recipient and DATA"""
+        server.ehlo_or_helo_if_needed()
+        code, response = server.mail(message.sender)
+        if code != 250:
+            raise smtplib.SMTPSenderRefused(code, response, message.sender)
+        recipients = message.recipients()
+        if not recipients:
+            raise smtplib.SMTPRecipientsRefused({})
+        refused = {}
+        for recipient in recipients:
+            code, response = server.rcpt(recipient)
+            if code not in (250, 251):
+                refused[recipient] = (code, response)
+        if len(refused) == len(recipients):
+            raise smtplib.SMTPRecipientsRefused(refused)
+        
+        code, response = server.docmd("data")
+        if code != 354:
+            raise smtplib.SMTPDataError(code, response)
+    
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
+
+# Style declarations that Qt writes out but mail clients already default to; the body's
+# font weight and style are the defaults for the whole message
+DEFAULT_STYLE_VALUES = {'text-indent': "0px"}
+BODY_DEFAULT_STYLE_VALUES = {'text-indent': "0px", 'font-weight': "400", 'font-style': "normal"}
+MARGIN_PROPERTIES = ("margin-top", "margin-right", "margin-bottom", "margin-left")
+VOID_ELEMENTS = frozenset(["br", "img", "hr", "meta", "link", "input", "col", "area", "base", "wbr"])
+SKIPPED_ELEMENTS = frozenset(["head", "style", "title", "script"])
+
+def compact_style(style, defaults=DEFAULT_STYLE_VALUES):
+    """Style attribute without Qt-specific and default-valued declarations, or "" if nothing is left"""
+    declarations = {}
+    for declaration in style.split(";"):
+        name, _, value = declaration.partition(":")
+        name = name.strip().lower()
+        value = value.strip()
+        if not name or not value or name.startswith("-qt-") or defaults.get(name) == value:
+            continue
+        declarations[name] = value
+    
+    # Qt spells out all four margins on every block; mail clients need them (<p> has its own
+    # default margins) but not in long form
+    if all(name in declarations for name in MARGIN_PROPERTIES):
+        margins = [declarations.pop(name) for name in MARGIN_PROPERTIES]
+        margins = [margin if margin not in ("0px", "0") else "0" for margin in margins]
+        if len(set(margins)) == 1:
+            declarations['margin'] = margins[0]
+        elif margins[1] == margins[3]:
+            declarations['margin'] = " ".join(margins[:3]) if margins[0] != margins[2] else " ".join(margins[:2])
+        else:
+            declarations['margin'] = " ".join(margins)
+    return ";".join(f"{name}:{value}" for name, value in declarations.items())
+
+class HTMLCompactor(HTMLParser):
+    """Rewrites Qt rich-text HTML as minimal HTML for mail; see compact_html"""
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        # Open elements as (tag, emitted); unstyled spans are dropped and not emitted
+        self.stack = []
+        self.skipping = 0
+        # Style of the span closed by the last part, so an identical span that follows continues it
+        self.closed_span_style = None
+    
+    def attributes(self, tag, attrs):
+        rendered = []
+        for name, value in attrs:
+            if name == "style":
+                value = compact_style(value or "", BODY_DEFAULT_STYLE_VALUES if tag == "body" else DEFAULT_STYLE_VALUES)
+                if not value:
+                    continue
+            if value is None:
+                rendered.append(f" {name}")
+            else:
+                rendered.append(f' {name}="{value.replace("&", "&amp;").replace(chr(34), "&quot;")}"')
+        return "".join(rendered)
+    
+    def emit(self, part):
+        self.parts.append(part)
+        self.closed_span_style = None
+    
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_ELEMENTS:
+            self.skipping += 1
+            return
+        if self.skipping or tag == "html":
+            return
+        if tag == "body":
+            # The document-wide font becomes one wrapper element
+            rendered = self.attributes("body", [(name, value) for name, value in attrs if name == "style"])
+            self.stack.append(("body", bool(rendered)))
+            if rendered:
+                self.emit(f"<div{rendered}>")
+            return
+        
+        rendered = self.attributes(tag, attrs)
+        if tag in VOID_ELEMENTS:
+            self.emit(f"<{tag}{rendered}>")
+            return
+        if tag == "span":
+            if not rendered:
+                self.stack.append(("span", False))
+                return
+            if self.closed_span_style == rendered:
+                # <span a>x</span><span a>y</span> becomes <span a>xy</span>
+                self.parts.pop()
+                self.closed_span_style = None
+                self.stack.append(("span", rendered))
+                return
+            self.stack.append(("span", rendered))
+            self.emit(f"<span{rendered}>")
+            return
+        self.stack.append((tag, True))
+        self.emit(f"<{tag}{rendered}>")
+    
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_ELEMENTS:
+            self.handle_endtag(tag)
+    
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_ELEMENTS:
+            self.skipping = max(0, self.skipping - 1)
+            return
+        if self.skipping or tag == "html" or tag in VOID_ELEMENTS:
+            return
+        if not any(open_tag == tag for open_tag, emitted in self.stack):
+            return
+        # Close everything opened inside the element as well
+        while self.stack:
+            open_tag, emitted = self.stack.pop()
+            if emitted:
+                closing = "</div>" if open_tag == "body" else f"</{open_tag}>"
+                self.emit(closing)
+                if open_tag == "span":
+                    self.closed_span_style = emitted
+            if open_tag == tag:
+                break
+    
+    def handle_data(self, data):
+        if self.skipping:
+            return
+        # Newlines between blocks are source formatting only
+        if not data.strip() and "\n" in data:
+            return
+        # Qt renders text as pre-wrap; runs of spaces survive as non-breaking spaces
+        data = re.sub(r" {2,}", lambda match: "\xa0" * (len(match.group()) - 1) + " ", data)
+        self.emit(html_lib.escape(data, quote=False).replace("\xa0", "&nbsp;"))
+    
+    def result(self):
+        while self.stack:
+            self.handle_endtag(self.stack[-1][0])
+        return "".join(self.parts)
+
+def compact_html(html):
+    """Minimal HTML for an outgoing message: no DOCTYPE, head or Qt-specific styles, redundant spans merged"""
+    compactor = HTMLCompactor()
+    compactor.feed(html)
+    compactor.close()
+    return compactor.result()
+
+class HTMLTextExtractor(HTMLParser):
+    """Plain-text rendering of HTML with line breaks and list markers; see html_to_text"""
+    BLOCK_ELEMENTS = frozenset(["p", "div", "li", "ul", "ol", "h1", "h2", "h3", "h4", "h5", "h6",
+                                "tr", "table", "blockquote", "pre"])
+    
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.lines = []
+        self.line = ""
+        self.skipping = 0
+        # Open lists as [tag, next item number]
+        self.lists = []
+    
+    def break_line(self, force=False):
+        if force or self.line.strip():
+            self.lines.append(self.line.rstrip())
+        self.line = ""
+    
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_ELEMENTS:
+            self.skipping += 1
+        elif tag == "br":
+            self.break_line(force=True)
+        elif tag in ("ul", "ol"):
+            self.break_line()
+            start = dict(attrs).get("start") or "1"
+            self.lists.append([tag, int(start) if start.isdigit() else 1])
+        elif tag == "li":
+            self.break_line()
+            indent = "  " * max(0, len(self.lists) - 1)
+            if self.lists and self.lists[-1][0] == "ol":
+                self.line = f"{indent}{self.lists[-1][1]}. "
+                self.lists[-1][1] += 1
+            else:
+                self.line = f"{indent}- "
+        elif tag in self.BLOCK_ELEMENTS:
+            self.break_line()
+    
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_ELEMENTS:
+            self.skipping = max(0, self.skipping - 1)
+        elif tag in ("ul", "ol"):
+            self.break_line()
+            if self.lists:
+                self.lists.pop()
+        elif tag in self.BLOCK_ELEMENTS:
+            self.break_line()
+    
+    def handle_data(self, data):
+        if self.skipping or (not data.strip() and "\n" in data):
+            return
+        self.line += data.replace("\xa0", " ")
+    
+    def result(self):
+        self.break_line()
+        return "\n".join(self.lines).strip("\n") + "\n"
+
+def html_to_text(html):
+    """Plain-text alternative of an HTML body: one line per paragraph, "- " and "1. " list markers"""
+    extractor = HTMLTextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return extractor.result()
+
+class StreamingMIMEMessage:
+    """Outgoing multipart message serialised lazily, line by line, with attachments read in chunks"""
+    # 57 input bytes encode to exactly one 76-character base64 line
+    CHUNK_SIZE = 57 * 1024
+    
+    def __init__(self, sender, recipient, subject, body_html, attachments, compact=True):
+        self.sender = sender
+        self.recipient = recipient
+        self.subject = subject
+        # Editor HTML is mostly Qt boilerplate; the body is sent as minimal HTML plus a plain-text alternative
+        self.body_html = compact_html(body_html) if compact else body_html
+        self.body_text = html_to_text(self.body_html)
+        self.attachments = list(attachments)
+        self.boundary = "===============" + uuid.uuid4().hex
+        self.alternative_boundary = "===============" + uuid.uuid4().hex
+        self.date = formatdate(localtime=True)
+        self.message_id = make_msgid()
+    
+    def check_attachments(self):
+        """Raise OSError if any attachment cannot be opened for reading"""
+        for file_path in self.attachments:
+            with open(file_path, 'rb'):
+                pass
+    
+    def recipients(self):
+        """Envelope recipients parsed from the To field"""
+        return [address for _, address in getaddresses([self.recipient]) if address]
+    
+    @staticmethod
+    def header_block(headers):
+        block = EmailMessage(policy=email.policy.SMTP)
+        for name, value, params in headers:
+            block.add_header(name, value, **params)
+        return b"".join(block.policy.fold_binary(name, value) for name, value in block.items()) + b"\r\n"
+    
+    @staticmethod
+    def base64_lines(data):
+        return base64.encodebytes(data).replace(b"\n", b"\r\n")
+    
+    @staticmethod
+    def quoted_printable_lines(text):
+        """Quoted-printable body with CRLF line ends; far smaller than base64 for mostly ASCII text"""
+        encoded = quopri.encodestring(text.replace("\r\n", "\n").encode("utf-8")).replace(b"\n", b"\r\n")
+        return encoded if encoded.endswith(b"\r\n") else encoded + b"\r\n"
+    
+    def iter_body(self):
+        """The multipart/alternative body: plain text first, HTML last (preferred)"""
+        delimiter = f"--{self.alternative_boundary}\r\n".encode("ascii")
+        for content_type, content in (('text/plain', self.body_text), ('text/html', self.body_html)):
+            yield delimiter
+            yield self.header_block([
+                ('Content-Type', content_type, {'charset': 'utf-8'}),
+                ('Content-Transfer-Encoding', 'quoted-printable', {}),
+            ])
+            yield self.quoted_printable_lines(content)
+        yield f"--{self.alternative_boundary}--\r\n".encode("ascii")
+    
+    def iter_chunks(self):
+        """Yield the serialised message; at most one attachment chunk is held in memory at a time"""
+        yield self.header_block([
+            ('From', self.sender, {}),
+            ('To', self.recipient, {}),
+            ('Subject', self.subject, {}),
+            ('Date', self.date, {}),
+            ('Message-ID', self.message_id, {}),
+            ('MIME-Version', '1.0', {}),
+            ('Content-Type', 'multipart/mixed', {'boundary': self.boundary}) if self.attachments else
+            ('Content-Type', 'multipart/alternative', {'boundary': self.alternative_boundary}),
+        ])
+        if not self.attachments:
+            yield from self.iter_body()
+            return
+        
+        # Text and HTML body, nested as the first part
+        delimiter = f"--{self.boundary}\r\n".encode("ascii")
+        yield delimiter
+        yield self.header_block([('Content-Type', 'multipart/alternative', {'boundary': self.alternative_boundary})])
+        yield from self.iter_body()
+        
+        # Attachments, encoded incrementally
+        for file_path in self.attachments:
+            yield delimiter
+            yield self.header_block([
+                ('Content-Type', 'application/octet-stream', {}),
+                ('Content-Transfer-Encoding', 'base64', {}),
+                ('Content-Disposition', 'attachment', {'filename': os.path.basename(file_path)}),
+            ])
+            with open(file_path, 'rb') as file:
+                while True:
+                    chunk = file.read(self.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    yield self.base64_lines(chunk)
+        
+        yield f"--{self.boundary}--\r\n".encode("ascii")
+
+class Outbox:
+    """Disk-backed queue of outgoing emails delivered by a background thread with retries"""
+    def __init__(self, path, smtp_manager, on_status=None, max_attempts=6,
+                 base_delay=5.0, max_delay=600.0):
+        self.smtp_manager = smtp_manager
+        self.on_status = on_status
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+        
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL,
+                last_error TEXT,
+                created REAL NOT NULL
+            )
+        """)
+        # A message that was mid-delivery when the app stopped is retried
+        self.db.execute("UPDATE outbox SET status = 'pending' WHERE status = 'sending'")
+        self.db.commit()
+    
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="outbox-sender", daemon=True)
+            self.thread.start()
+    
+    def stop(self, timeout=2.0):
+        self.stopping.set()
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+    
+    def enqueue(self, sender, recipient, subject, body_html, attachments):
+        job_id = uuid.uuid4().hex
+        payload = json.dumps({
+            'sender': sender,
+            'recipient': recipient,
+            'subject': subject,
+            'body_html': body_html,
+            'attachments': list(attachments),
+        })
+        now = time.time()
+        with self.lock:
+            self.db.execute("INSERT INTO outbox (id, payload, status, next_attempt, created) VALUES (?, ?, 'pending', ?, ?)",
+                            (job_id, payload, now, now))
+            self.db.commit()
+        self.wakeup.set()
+        return job_id
+    
+    def pending_count(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM outbox WHERE status IN ('pending', 'sending')").fetchone()[0]
+    
+    def next_job(self):
+        """Claim the next due job, or return the delay until one is due (None if the queue is empty)"""
+        with self.lock:
+            row = self.db.execute("""
+                SELECT id, payload, attempts, next_attempt FROM outbox
+                WHERE status = 'pending' ORDER BY next_attempt LIMIT 1
+            """).fetchone()
+            if row is None:
+                return None, None
+            job_id, payload, attempts, next_attempt = row
+            delay = next_attempt - time.time()
+            if delay > 0:
+                return None, delay
+            self.db.execute("UPDATE outbox SET status = 'sending' WHERE id = ?", (job_id,))
+            self.db.commit()
+            return (job_id, json.loads(payload), attempts), 0
+    
+    def run(self):
+        while not self.stopping.is_set():
+            job, delay = self.next_job()
+            if job is None:
+                self.wakeup.wait(delay)
+                self.wakeup.clear()
+                continue
+            self.deliver(*job)
+    
+    def deliver(self, job_id, payload, attempts):
+        recipient = payload['recipient']
+        self.report(f"Sending email to {recipient}...")
+        try:
+            with TRACER.span("outbox.deliver", attempt=attempts + 1, attachments=len(payload['attachments'])):
+                message = StreamingMIMEMessage(payload['sender'], recipient, payload['subject'],
+                                               payload['body_html'], payload['attachments'])
+                self.smtp_manager.send_streaming(message)
+        except Exception as e:
+            attempts += 1
+            with self.lock:
+                if attempts >= self.max_attempts or not self.is_retryable(e):
+                    self.db.execute("UPDATE outbox SET status = 'failed', attempts = ?, last_error = ? WHERE id = ?",
+                                    (attempts, str(e), job_id))
+                    message = f"Failed to send email to {recipient}: {str(e)}"
+                else:
+                    # Exponential backoff with jitter so retries do not arrive in lockstep
+                    delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+                    self.db.execute("UPDATE outbox SET status = 'pending', attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+                                    (attempts, time.time() + delay, str(e), job_id))
+                    message = f"Sending to {recipient} failed, retrying in {delay:.0f}s: {str(e)}"
+                self.db.commit()
+            self.report(message)
+            return
+        
+        with self.lock:
+            self.db.execute("DELETE FROM outbox WHERE id = ?", (job_id,))
+            self.db.commit()
+        self.report(f"Email sent successfully to {recipient}!")
+    
+    @staticmethod
+    def is_retryable(error):
+        """Retry disconnects, network errors and 4xx replies; bad credentials, 5xx rejections and
+        unreadable attachments fail the same way every time (and repeated failed logins can lock the account)"""
+        if isinstance(error, smtplib.SMTPRecipientsRefused):
+            return any(code < 500 for code, _ in error.recipients.values())
+        if isinstance(error, smtplib.SMTPResponseException):
+            return 400 <= error.smtp_code < 500
+        if isinstance(error, smtplib.SMTPServerDisconnected):
+            return True
+        return isinstance(error, OSError) and not isinstance(
+            error, (FileNotFoundError, PermissionError, IsADirectoryError, NotADirectoryError))
+    
+    def report(self, message):
+        if self.on_status:
+            self.on_status(message)
+    
+    def close(self):
+        self.stop()
+        with self.lock:
+            self.db.close()
+
+# Matches the verdict in a (possibly partial) JSON reply
+JSON_VERDICT_PATTERN = re.compile(r'"verdict"\s*:\s*"(yes|not ok)"', re.IGNORECASE)
+
+def stream_verdict(text):
+    """Verdict from the start of a (possibly partial) validation response: True, False or None if unknown yet"""
+    head = text.lstrip()
+    if head.startswith("{"):
+        match = JSON_VERDICT_PATTERN.search(head)
+        return None if match is None else match.group(1).lower() == "yes"
+    head = head.lower()
+    if head.startswith("yes"):
+        return True
+    if head.startswith("not ok"):
+        return False
+    return None
+
+class LocalValidator:
+    """Deterministic checks that need no model: empty fields, address syntax, brackets, quotes and attachments"""
+    ADDRESS_PATTERN = re.compile(
+        r"[A-Za-z0-9.!#$%&'*+/=?^_`{|}~-]+@[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?"
+        r"(?:\.[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?)+")
+    # Only the characters the bracket/quote scan cares about
+    DELIMITER_PATTERN = re.compile(r'[()\[\]{}"\u201c\u201d\n]')
+    # "1)", "a)", "Option A)", "Step 2)" at the start of a line are list markers, not unmatched brackets
+    LIST_MARKER_PATTERN = re.compile(r"\s*(?:[^\W\d]+\s+)?\w{1,3}")
+    # Only first-person or "please find" phrasings that claim a file comes with this email ("I've attached",
+    # "please find ... enclosed", "Attached is"), not talk about someone else's file ("the attachment you
+    # sent") or other senses of the words ("no attachment needed", "I attach great importance")
+    ATTACHMENT_PATTERN = re.compile(
+        r"\b(?:(?:I|we)(?:'ve| have)?\s+(?:also\s+|just\s+|now\s+|already\s+)?(?:attached|enclosed)"
+        r"|(?:I|we)(?:'ll| will)?\s+(?:also\s+)?(?:attach|enclose)\s+(?:a|an|the|my|our|this|these|it|them|here|herewith)\b"
+        r"|(?:I|we)(?:'m|'re| am| are)\s+(?:also\s+|now\s+)?(?:attaching|enclosing)"
+        r"|(?:please\s+)?(?:see|find)\s+(?:\w+\s+){0,3}?(?:attached|enclosed|attachments?)"
+        r"|(?:my|our) attached"
+        r"|(?:^|(?<=[.!?] ))(?:attached|enclosed) (?:is|are|please)"
+        r")\b", re.IGNORECASE | re.MULTILINE)
+    # Feet and inches right before a '"' (5'10"): an inch mark even inside a quotation
+    FEET_INCHES_PATTERN = re.compile(r"\d['\u2019]\d{1,2}$")
+    PAIRS = {')': '(', ']': '[', '}': '{', '\u201d': '\u201c'}
+    
+    def check(self, recipient, subject, plain_body, attachments):
+        """Return a list of issues; an empty list means the draft passed the local rules"""
+        issues = []
+        
+        addresses = [address for _, address in getaddresses([recipient])] if recipient.strip() else []
+        if not addresses:
+            issues.append("Missing recipient email address")
+        for address in addresses:
+            if not self.ADDRESS_PATTERN.fullmatch(address):
+                issues.append(f"Invalid recipient email address: {address or recipient.strip()}")
+        
+        if not subject.strip():
+            issues.append("Empty subject line")
+        
+        if not plain_body.strip():
+            issues.append("Empty email body")
+        else:
+            issues.extend(self.check_delimiters(plain_body))
+            if not attachments and self.ATTACHMENT_PATTERN.search(plain_body):
+                issues.append("The email mentions an attachment, but no files are attached")
+        return issues
+    
+    def check_delimiters(self, text):
+        """Single pass over the bracket and quote characters of text"""
+        stack = []
+        unmatched = []
+        straight_quotes = 0
+        line_start = 0
+        for match in self.DELIMITER_PATTERN.finditer(text):
+            char = match.group()
+            position = match.start()
+            if char == '\n':
+                line_start = position + 1
+            elif char == '"':
+                # Inch marks (5'10", 27" screen) are not quotes, but a quote can close after a digit ("Phase 2")
+                if not (text[position - 1:position].isdigit()
+                        and (not straight_quotes % 2 or self.FEET_INCHES_PATTERN.search(text, line_start, position))):
+                    straight_quotes += 1
+            elif char in '([{\u201c':
+                stack.append(char)
+            else:
+                # Emoticons close nothing, nor do list markers unless a '(' is open for them to close
+                if char == ')' and (text[position - 1:position] in (':', ';', '-')
+                                    or (self.LIST_MARKER_PATTERN.fullmatch(text, line_start, position)
+                                        and not (stack and stack[-1] == '('))):
+                    continue
+                if stack and stack[-1] == self.PAIRS[char]:
+                    stack.pop()
+                else:
+                    unmatched.append(char)
+        
+        issues = [f"Unclosed '{char}' in the body" for char in stack]
+        issues += [f"Unmatched '{char}' in the body" for char in unmatched]
+        if straight_quotes % 2:
+            issues.append("Unclosed quotation mark in the body")
+        return issues
+
+def format_issues(issues):
+    """Render an issue list in the same "not ok" + numbered list form Gemini uses"""
+    return "not ok\n" + "\n".join(f"{number}. {issue}" for number, issue in enumerate(issues, 1))
+
+def common_prefix_length(a, b):
+    """Length of the common prefix of a and b, found by bisecting with C-level slice comparisons"""
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def changed_region_size(old, new):
+    """Size of the edited region between two versions of a text, after trimming the common prefix and suffix"""
+    prefix = common_prefix_length(old, new)
+    suffix = common_prefix_length(old[prefix:][::-1], new[prefix:][::-1])
+    return max(len(old), len(new)) - prefix - suffix
+
+# Words, runs of whitespace and single punctuation marks
+WORD_TOKEN_PATTERN = re.compile(r"\w+|\s+|[^\w\s]")
+
+def word_diff(old, new):
+    """Word-level edits turning old into new, as (start, end, replacement) offsets into old in ascending order
+
+    The unchanged head and tail are trimmed first and the rest is matched line by line, so only lines that
+    actually changed are diffed word by word; the cost follows the size of the changes, not of the text.
+    """
+    # Trim back to whitespace so edits always cover whole words
+    prefix = common_prefix_length(old, new)
+    while prefix and not old[prefix - 1].isspace():
+        prefix -= 1
+    suffix = common_prefix_length(old[prefix:][::-1], new[prefix:][::-1])
+    while suffix and not old[len(old) - suffix].isspace():
+        suffix -= 1
+    old_lines = old[prefix:len(old) - suffix].splitlines(keepends=True)
+    new_lines = new[prefix:len(new) - suffix].splitlines(keepends=True)
+    old_offsets = [prefix]
+    for line in old_lines:
+        old_offsets.append(old_offsets[-1] + len(line))
+    
+    edits = []
+    # Blank lines are too common to anchor a match
+    matcher = difflib.SequenceMatcher(lambda line: not line.strip(), old_lines, new_lines, autojunk=False)
+    for tag, old_first, old_last, new_first, new_last in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        start = old_offsets[old_first]
+        removed = old[start:old_offsets[old_last]]
+        replacement = "".join(new_lines[new_first:new_last])
+        if tag == "replace" and old_last - old_first == new_last - new_first:
+            # Lines edited in place: diff each pair on its own
+            for old_index, new_index in zip(range(old_first, old_last), range(new_first, new_last)):
+                edits.extend(word_edits(old_lines[old_index], new_lines[new_index], old_offsets[old_index]))
+        elif tag == "replace":
+            edits.extend(word_edits(removed, replacement, start))
+        elif not layout_only_edit(removed, replacement):
+            edits.append((start, start + len(removed), replacement))
+    return edits
+
+def word_edits(old, new, offset):
+    """Word-level edits within one changed block of lines, shifted by offset"""
+    old_tokens = WORD_TOKEN_PATTERN.findall(old)
+    new_tokens = WORD_TOKEN_PATTERN.findall(new)
+    old_offsets = [offset]
+    for token in old_tokens:
+        old_offsets.append(old_offsets[-1] + len(token))
+    
+    edits = []
+    # Whitespace never anchors a match (it is half of all tokens); matches still extend across it
+    matcher = difflib.SequenceMatcher(str.isspace, old_tokens, new_tokens)
+    for tag, old_first, old_last, new_first, new_last in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        removed = old[old_offsets[old_first] - offset:old_offsets[old_last] - offset]
+        replacement = "".join(new_tokens[new_first:new_last])
+        if not layout_only_edit(removed, replacement):
+            edits.append((old_offsets[old_first], old_offsets[old_last], replacement))
+    return edits
+
+def layout_only_edit(removed, replacement):
+    """Paragraph layout stays the old text's when only the spacing around a line break differs"""
+    return not removed.strip() and not replacement.strip() and "\n" in removed and "\n" in replacement
+
+# Prompt templates are dedented once at import so no indentation is sent to the model.
+# Improved subject validation to be less nitpicky; empty fields, address syntax, brackets,
+# quotes and attachment mentions are already covered by LocalValidator.
+# The semantic checks are shared by every prompt that asks for a verdict, filled in as {checklist}.
+SEMANTIC_CHECKLIST = textwrap.dedent("""\
+    1. Whether the name of the recipient in the email address is the same as the name used in the email body (if it exists)
+    2. A subject line that does not convey the overall meaning of the email body (don't be too strict about subject content)
+    3. Incomplete sentences
+    4. Grammar or spelling issues that significantly impact understanding
+    5. Any other technical problems that would significantly prevent effective communication""")
+
+VALIDATION_PROMPT = textwrap.dedent("""\
+    Please check if this email is technically correct and ready to send.
+    Set "verdict" to "yes" if everything is correct.
+    If there are issues, set "verdict" to "not ok" and list each specific issue that needs correction in "issues".
+
+    The address format, empty fields, brackets, quotes and attachment mentions have already been checked. Check for:
+    {checklist}
+
+    Email details:
+    TO: {recipient}
+    SUBJECT: {subject}
+    BODY{part}: {body}
+    ATTACHMENTS: {attachments}
+
+    Remember: "verdict" is "yes" only if everything is correct, and "issues" is empty in that case.""").replace(
+    "{checklist}", SEMANTIC_CHECKLIST)
+
+MINIMAL_REFINEMENT_PROMPT = textwrap.dedent("""\
+    There are no major errors in this email, but please make minimal improvements to enhance clarity, professionalism, and effectiveness.
+
+    Original email:
+    TO: {recipient}
+    SUBJECT: {subject}
+    BODY:
+    {body}
+
+    Return the refined subject in "subject" and the refined body in "body".
+
+    Keep the same meaning and tone—just make small improvements to grammar, clarity, and professionalism.""")
+
+FULL_REFINEMENT_PROMPT = textwrap.dedent("""\
+    Please refine this email to fix all issues and improve its clarity, professionalism, and effectiveness.
+
+    Original email:
+    TO: {recipient}
+    SUBJECT: {subject}
+    BODY:
+    {body}
+
+    Validation feedback:
+    {validation_result}
+
+    Return the refined subject in "subject" and the refined body in "body".
+
+    Fix all issues mentioned in the validation feedback and make any other improvements needed. Don't add unnessary information by yourself. Just refine where needed.""")
+
+COMBINED_PROMPT = textwrap.dedent("""\
+    Please check if this email is technically correct and ready to send, and refine it.
+
+    Check for:
+    {checklist}
+    {known_issues}
+    Set "verdict" to "yes" if everything is correct, otherwise to "not ok" and list each specific issue in "issues".
+    In "subject" and "body", return the refined email: fix all issues, otherwise only make minimal improvements to grammar, clarity and professionalism. Keep the same meaning and tone and don't add unnecessary information.
+
+    Original email:
+    TO: {recipient}
+    SUBJECT: {subject}
+    BODY:
+    {body}
+    ATTACHMENTS: {attachments}""").replace("{checklist}", SEMANTIC_CHECKLIST)
+
+BATCH_VALIDATION_PROMPT = textwrap.dedent("""\
+    Please check each of the following emails and decide whether it is technically correct and ready to send.
+    Every email starts with a line "=== DRAFT <id> ===". Return one entry in "results" per email, with its id.
+    Set "verdict" to "yes" if everything is correct, otherwise to "not ok" and list each specific issue in "issues".
+
+    The address format, empty fields, brackets, quotes and attachment mentions have already been checked. Check for:
+    {checklist}
+
+    Judge every email on its own.
+
+    {drafts}""").replace("{checklist}", SEMANTIC_CHECKLIST)
+
+BATCH_DRAFT_TEMPLATE = textwrap.dedent("""\
+    === DRAFT {draft_id} ===
+    TO: {recipient}
+    SUBJECT: {subject}
+    BODY: {body}
+    ATTACHMENTS: {attachments}
+    """)
+
+# Fields of the structured replies requested through the Gemini JSON mode
+RESULT_PROPERTIES = {
+    "verdict": {"type": "STRING", "enum": ["yes", "not ok"]},
+    "issues": {"type": "ARRAY", "items": {"type": "STRING"}},
+    "subject": {"type": "STRING"},
+    "body": {"type": "STRING"},
+}
+
+def response_schema(*fields):
+    # propertyOrdering keeps the verdict first so streamed replies can be judged early
+    return {
+        "type": "OBJECT",
+        "properties": {field: RESULT_PROPERTIES[field] for field in fields},
+        "required": list(fields),
+        "propertyOrdering": list(fields),
+    }
+
+VALIDATION_SCHEMA = response_schema("verdict", "issues")
+REFINEMENT_SCHEMA = response_schema("subject", "body")
+RESULT_SCHEMA = response_schema("verdict", "issues", "subject", "body")
+BATCH_VALIDATION_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "results": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {"id": {"type": "STRING"}, **VALIDATION_SCHEMA["properties"]},
+                "required": ["id", "verdict", "issues"],
+                "propertyOrdering": ["id", "verdict", "issues"],
+            },
+        },
+    },
+    "required": ["results"],
+}
+
+# Complete reply cached when a streamed validation is cut short after a passing verdict
+PASS_REPLY = json.dumps({"verdict": "yes", "issues": []})
+
+# Where quoted reply history starts: "On <date>, <name> wrote:", Outlook headers, forwarded blocks.
+# The "On ... wrote:" line must contain a time, a numeric date or an address, so that a body line
+# such as "On reflection, this is what I wrote:" is not taken for one
+QUOTE_HEADER_PATTERN = re.compile(
+    r"^(?:On (?=.{0,200}?(?:\d{1,2}:\d{2}|\d{1,4}[/.-]\d{1,2}[/.-]\d{1,4}|[\w.+-]+@[\w-]+\.\w))"
+    r".{0,200}wrote:\s*$|-{2,}\s*(?:Original|Forwarded) Message\s*-{2,}|From: .+\n(?:Sent|Date): )",
+    re.MULTILINE | re.IGNORECASE)
+# Standard "-- " signature delimiter (not a bare "--" divider) and common mobile footers
+SIGNATURE_PATTERN = re.compile(r"^(?:-- |Sent from my \w+.*)$", re.MULTILINE)
+QUOTED_LINE_PATTERN = re.compile(r"^[ \t]*>.*(?:\n|$)", re.MULTILINE)
+INLINE_SPACE_PATTERN = re.compile(r"[ \t\u00a0]+")
+BLANK_LINES_PATTERN = re.compile(r"\n\s*\n\s*")
+NUMBERED_ITEM_PATTERN = re.compile(r"^\s*\d+[.)]\s*(.+)$", re.MULTILINE)
+# Bullet ("-", "*", "\u2022") or numbered ("1." / "12)") list item with its indentation, for text_to_html;
+# numbers stop at three digits so a sentence like "2024. was a strong year" stays a paragraph
+LIST_ITEM_STARTS = frozenset("-*\u20220123456789")
+LIST_ITEM_PATTERN = re.compile(r"(?P<indent>[ \t]*)(?:[-*\u2022]|(?P<number>\d{1,3})[.)])[ \t]+(?P<content>\S.*)")
+
+def collapse_whitespace(text):
+    """Collapse runs of spaces and blank lines, keeping paragraph breaks"""
+    text = INLINE_SPACE_PATTERN.sub(" ", text)
+    text = BLANK_LINES_PATTERN.sub("\n\n", text)
+    return "\n".join(line.strip() for line in text.split("\n")).strip()
+
+def strip_quoted_history(text):
+    """Drop quoted reply history and the signature, which the model does not need to judge the new text"""
+    match = QUOTE_HEADER_PATTERN.search(text)
+    if match:
+        text = text[:match.start()]
+    match = SIGNATURE_PATTERN.search(text)
+    if match:
+        text = text[:match.start()]
+    return QUOTED_LINE_PATTERN.sub("", text)
+
+def attachment_names(attachments):
+    """The ATTACHMENTS line of a prompt: file names only, or None"""
+    return ', '.join(os.path.basename(path) for path in attachments) if attachments else 'None'
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text
+    return len(text) // 4 + 1
+
+def split_into_chunks(text, max_tokens):
+    """Pack paragraphs into chunks of at most max_tokens, hard-splitting paragraphs that are too long"""
+    max_chars = max(1, max_tokens * 4)
+    pieces = []
+    for paragraph in text.split("\n\n"):
+        while len(paragraph) > max_chars:
+            cut = paragraph.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            pieces.append(paragraph[:cut])
+            paragraph = paragraph[cut:].lstrip()
+        pieces.append(paragraph)
+    
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + 2 + len(piece) > max_chars:
+            chunks.append(current)
+            current = piece
+        else:
+            current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+def parse_issues(text):
+    """Issue lines of a "not ok" reply"""
+    issues = NUMBERED_ITEM_PATTERN.findall(text)
+    if issues:
+        return [issue.strip() for issue in issues]
+    lines = [line.strip() for line in text.splitlines()]
+    return [line for line in lines if line and line.lower() != "not ok"]
+
+# Fields of a partial JSON reply, used to render streamed output before it is complete
+PARTIAL_STRING_PATTERN = re.compile(r'"(verdict|subject|body)"\s*:\s*"((?:[^"\\]|\\.)*)')
+PARTIAL_ISSUES_PATTERN = re.compile(r'"issues"\s*:\s*\[((?:\s*"(?:[^"\\]|\\.)*"\s*,?)*)')
+JSON_STRING_PATTERN = re.compile(r'"((?:[^"\\]|\\.)*)"')
+
+def decode_json_string(raw):
+    """Decode the body of a JSON string literal that may be cut off mid-escape"""
+    for cut in range(7):
+        try:
+            return json.loads('"' + raw[:len(raw) - cut] + '"')
+        except ValueError:
+            continue
+    return ""
+
+class GeminiResult:
+    """Reply parsed once into verdict, issues and (for refinements) subject and body"""
+    def __init__(self, verdict=None, issues=(), subject="", body="", error=None, raw=""):
+        self.verdict = verdict
+        self.issues = list(issues)
+        self.subject = subject
+        self.body = body
+        self.error = error
+        self.raw = raw
+        self.html = None
+    
+    @classmethod
+    def from_issues(cls, issues):
+        """Result of the local rule checks"""
+        return cls("not ok" if issues else "yes", issues)
+    
+    @classmethod
+    def failure(cls, message):
+        return cls(error=message)
+    
+    @classmethod
+    def parse(cls, reply):
+        """Parse a structured JSON reply; plain "yes"/"not ok" and SUBJECT:/BODY: text are accepted as a fallback"""
+        try:
+            data = json.loads(reply)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            return cls.parse_text(reply)
+        
+        verdict = data.get('verdict')
+        return cls(verdict.lower() if isinstance(verdict, str) else None,
+                   [str(issue) for issue in data.get('issues') or []],
+                   data.get('subject') or "", data.get('body') or "", raw=reply)
+    
+    @classmethod
+    def parse_text(cls, reply):
+        verdict = {True: "yes", False: "not ok"}.get(stream_verdict(reply))
+        issues = parse_issues(reply) if verdict == "not ok" else []
+        subject = body = ""
+        subject_start = reply.find("SUBJECT:")
+        body_start = reply.find("BODY:")
+        if subject_start != -1 and body_start > subject_start:
+            subject = reply[subject_start + 8:body_start].strip()
+            body = reply[body_start + 5:].strip()
+        return cls(verdict, issues, subject, body, raw=reply)
+    
+    @classmethod
+    def parse_partial(cls, buffer):
+        """Best-effort view of an incomplete streamed JSON reply"""
+        if not buffer.lstrip().startswith("{"):
+            return cls.parse_text(buffer)
+        try:
+            json.loads(buffer)
+            return cls.parse(buffer)
+        except ValueError:
+            pass
+        fields = {name: decode_json_string(value) for name, value in PARTIAL_STRING_PATTERN.findall(buffer)}
+        issues = []
+        match = PARTIAL_ISSUES_PATTERN.search(buffer)
+        if match:
+            issues = [decode_json_string(issue) for issue in JSON_STRING_PATTERN.findall(match.group(1))]
+        verdict = fields.get('verdict', "").lower()
+        return cls(verdict if verdict in ("yes", "not ok") else None, issues,
+                   fields.get('subject', ""), fields.get('body', ""), raw=buffer)
+    
+    @property
+    def passed(self):
+        return self.error is None and self.verdict == "yes" and not self.issues
+    
+    def to_text(self):
+        if self.error is not None:
+            return f"Error: {self.error}"
+        return "yes" if self.passed else format_issues(self.issues)
+    
+    def to_html(self):
+        """HTML for the result panels, built on first use"""
+        if self.html is None:
+            if self.error is not None:
+                self.html = f"<p>Error calling Gemini API: {html_lib.escape(self.error)}</p>"
+            elif self.passed:
+                self.html = "<p>yes</p>"
+            elif self.issues:
+                items = "".join(f"<li>{html_lib.escape(issue)}</li>" for issue in self.issues)
+                self.html = f"<p>not ok</p><ol>{items}</ol>"
+            elif self.verdict == "not ok":
+                self.html = "<p>not ok</p>"
+            else:
+                self.html = "<p>Error: Unable to read the verdict from Gemini's reply.</p>"
+        return self.html
+    
+    def to_json(self):
+        return json.dumps({'verdict': self.verdict, 'issues': self.issues,
+                           'subject': self.subject, 'body': self.body})
+
+class BatchSizer:
+    """Adaptive number of drafts per batched request: grows while batches are fast and parse cleanly, halves otherwise"""
+    def __init__(self, initial=4, maximum=16, target_latency=20.0):
+        self.size = initial
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.lock = threading.Lock()
+    
+    def record(self, items, seconds, ok=True):
+        with self.lock:
+            if ok and seconds <= self.target_latency:
+                # Only a full batch shows that a bigger one might work
+                if items >= self.size:
+                    self.size = min(self.maximum, self.size + 1)
+            else:
+                # Never below two, or no batch would ever be sent again to grow from
+                self.size = max(min(2, self.maximum), min(self.size, items) // 2)
+
+class EmailEngine:
+    """Prompt building, Gemini calls and response parsing, independent of the GUI"""
+    def __init__(self, api_key, cache_path=None, provider=None):
+        # Model backend: the Gemini client by default, or any LLMProvider (e.g. a local server)
+        self.provider = provider or GeminiClient(api_key)
+        
+        # Cache of Gemini responses so unchanged prompts return instantly
+        self.response_cache = ResponseCache(cache_path)
+        
+        # Rate limit, retries and circuit breaker for every network call
+        self.governor = RequestGovernor()
+        
+        # Model per task, with latency/error-based fallback and optional hedging
+        self.router = ModelRouter()
+        self.hedge_executor = None
+        
+        # Cheap deterministic checks that run before any Gemini call
+        self.local_validator = LocalValidator()
+        
+        # Validation prompts above this estimated size are split into chunks
+        self.max_prompt_tokens = 8000
+        
+        # Drafts per request when validating in bulk (validate_many)
+        self.batch_sizer = BatchSizer()
+    
+    def create_validation_prompt(self, recipient, subject, plain_body, attachments, part=""):
+        body = collapse_whitespace(strip_quoted_history(plain_body))
+        return VALIDATION_PROMPT.format(
+            recipient=recipient.strip(),
+            subject=collapse_whitespace(subject),
+            part=part,
+            body=body,
+            attachments=attachment_names(attachments))
+    
+    def create_minimal_refinement_prompt(self, recipient, subject, body):
+        # The body is refined in full (history and signature included), only whitespace is compacted
+        return MINIMAL_REFINEMENT_PROMPT.format(
+            recipient=recipient.strip(), subject=collapse_whitespace(subject), body=collapse_whitespace(body))
+
+    def create_full_refinement_prompt(self, recipient, subject, body, validation_result):
+        return FULL_REFINEMENT_PROMPT.format(
+            recipient=recipient.strip(), subject=collapse_whitespace(subject), body=collapse_whitespace(body),
+            validation_result=collapse_whitespace(validation_result))
+    
+    def validation_prompts(self, recipient, subject, plain_body, attachments):
+        """One prompt, or one per chunk when the compacted body exceeds the token budget"""
+        prompt = self.create_validation_prompt(recipient, subject, plain_body, attachments)
+        if estimate_tokens(prompt) <= self.max_prompt_tokens:
+            return [prompt]
+        
+        body = collapse_whitespace(strip_quoted_history(plain_body))
+        overhead = estimate_tokens(prompt) - estimate_tokens(body)
+        chunks = split_into_chunks(body, max(256, self.max_prompt_tokens - overhead))
+        return [self.create_validation_prompt(recipient, subject, chunk, attachments,
+                                              part=f" (part {number} of {len(chunks)})")
+                for number, chunk in enumerate(chunks, 1)]
+    
+    def validate_semantic(self, recipient, subject, plain_body, attachments,
+                          progress_callback=None, stop_on_pass=False):
+        """Gemini validation of a draft; long bodies are validated per chunk and the issues merged"""
+        with TRACER.span("prompt.build", kind="validate") as span:
+            prompts = self.validation_prompts(recipient, subject, plain_body, attachments)
+            span.set(prompts=len(prompts))
+        if len(prompts) == 1:
+            return self.call_gemini_api(prompts[0], progress_callback, stop_on_pass)
+        
+        # Map: validate the chunks concurrently. Reduce: fail if any chunk failed
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=min(4, len(prompts))) as executor:
+            results = list(executor.map(self.call_gemini_api, prompts))
+        
+        issues = []
+        for number, result in enumerate(results, 1):
+            if result.error is not None:
+                return result
+            if not result.passed:
+                issues.extend(f"(part {number}) {issue}" for issue in result.issues or ["Issues found"])
+        result = GeminiResult.from_issues(issues)
+        if progress_callback is not None:
+            progress_callback(result.to_json())
+        return result
+    
+    def create_batch_validation_prompt(self, drafts):
+        """One prompt for several (draft_id, recipient, subject, plain_body, attachments) tuples"""
+        blocks = [BATCH_DRAFT_TEMPLATE.format(
+            draft_id=draft_id,
+            recipient=recipient.strip(),
+            subject=collapse_whitespace(subject),
+            body=collapse_whitespace(strip_quoted_history(plain_body)),
+            attachments=attachment_names(attachments))
+            for draft_id, recipient, subject, plain_body, attachments in drafts]
+        return BATCH_VALIDATION_PROMPT.format(drafts="\n".join(blocks))
+    
+    @staticmethod
+    def parse_batch_reply(reply):
+        """Map each draft id in a batched reply to its GeminiResult; malformed entries are left out"""
+        try:
+            entries = json.loads(reply).get('results') or []
+        except (ValueError, AttributeError):
+            return {}
+        results = {}
+        for entry in entries:
+            if not isinstance(entry, dict) or entry.get('verdict') not in ("yes", "not ok"):
+                continue
+            issues = [str(issue) for issue in entry.get('issues') or []]
+            results[str(entry.get('id'))] = GeminiResult(entry['verdict'], issues)
+        return results
+    
+    def validate_many(self, drafts):
+        """Validate draft dicts (to, subject, body, attachments) several per request; results keep the input order
+
+        Drafts failing the local checks never reach Gemini, drafts too long to share a prompt are
+        validated on their own, and drafts missing from a batched reply fall back to a single call.
+        """
+        results = [None] * len(drafts)
+        queue = []
+        for index, draft in enumerate(drafts):
+            fields = (draft.get('to', ''), draft.get('subject', ''), draft.get('body', ''), draft.get('attachments') or [])
+            issues = self.local_validator.check(*fields)
+            if issues:
+                results[index] = GeminiResult.from_issues(issues)
+            elif estimate_tokens(self.create_validation_prompt(*fields)) > self.max_prompt_tokens // 2:
+                results[index] = self.validate_semantic(*fields)
+            else:
+                queue.append((index, fields))
+        
+        while queue:
+            # Take as many drafts as the current batch size and the token budget allow
+            batch = queue[:self.batch_sizer.size]
+            while True:
+                prompt = self.create_batch_validation_prompt(
+                    [(f"d{number}",) + fields for number, (_, fields) in enumerate(batch, 1)])
+                if len(batch) == 1 or estimate_tokens(prompt) <= self.max_prompt_tokens:
+                    break
+                batch = batch[:-1]
+            queue = queue[len(batch):]
+            
+            if len(batch) == 1:
+                index, fields = batch[0]
+                results[index] = self.validate_semantic(*fields)
+                continue
+            
+            start = time.perf_counter()
+            reply = self.call_batch(prompt)
+            if isinstance(reply, GeminiResult):
+                # The request itself failed; retrying per draft would only repeat the failure
+                self.batch_sizer.record(len(batch), time.perf_counter() - start, ok=False)
+                for index, _ in batch:
+                    results[index] = reply
+                continue
+            
+            # A few dropped entries are retried on their own; shrink only when most of the reply is unusable
+            parsed = self.parse_batch_reply(reply) if reply is not None else {}
+            self.batch_sizer.record(len(batch), time.perf_counter() - start, ok=len(parsed) >= 0.75 * len(batch))
+            for number, (index, fields) in enumerate(batch, 1):
+                results[index] = parsed.get(f"d{number}") or self.validate_semantic(*fields)
+        return results
+    
+    def call_batch(self, prompt):
+        """Raw reply to a batched validation prompt, or a failed GeminiResult"""
+        try:
+            return self.generate_text(prompt, generation_config={
+                "responseMimeType": "application/json",
+                "responseSchema": BATCH_VALIDATION_SCHEMA,
+            })
+        except TaskCancelled:
+            raise
+        except Exception as e:
+            return GeminiResult.failure(str(e))
+    
+    def generate_text(self, prompt, progress_callback=None, stop_on_pass=False, generation_config=None,
+                      task="validate"):
+        """Return the raw Gemini reply (None if there was no usable candidate), using the cache first"""
+        model = self.router.model_for(task) if self.provider.routable else self.provider.model
+        cache_prompt = prompt
+        if generation_config:
+            cache_prompt += "\n" + json.dumps(generation_config, sort_keys=True)
+        result = self.response_cache.get(model, cache_prompt)
+        if result is not None:
+            TRACER.count("cache.hits")
+            return result
+        TRACER.count("cache.misses")
+        
+        if progress_callback is not None:
+            # Streams are never hedged: two streams would interleave fragments in the GUI
+            result = self.governor.call(self.routed_call, model, self.stream_text,
+                                        prompt, progress_callback, stop_on_pass, generation_config)
+        else:
+            hedge = self.router.hedge_for(model)
+            if hedge is not None:
+                result = self.governor.call(self.hedged_generate, model, hedge, prompt, generation_config)
+            else:
+                result = self.governor.call(self.routed_call, model, self.provider.generate,
+                                            prompt, generation_config)
+        if result is not None:
+            self.response_cache.put(model, cache_prompt, result)
+        return result
+    
+    def routed_call(self, model, fn, *args):
+        """Call fn(*args, model=model) and record its latency and outcome for the router"""
+        start = time.perf_counter()
+        try:
+            result = fn(*args, model=model)
+        except TaskCancelled:
+            raise
+        except Exception:
+            self.router.record(model, time.perf_counter() - start, ok=False)
+            raise
+        self.router.record(model, time.perf_counter() - start, ok=result is not None)
+        return result
+    
+    def hedged_generate(self, model, hedge, prompt, generation_config=None):
+        """Ask the alternate model as well if the first has not answered in time; the first good reply wins"""
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+        alternate, delay = hedge
+        if self.hedge_executor is None:
+            self.hedge_executor = ThreadPoolExecutor(max_workers=8)
+        
+        pending = {self.hedge_executor.submit(self.routed_call, model, self.provider.generate,
+                                              prompt, generation_config)}
+        done, pending = wait(pending, timeout=delay)
+        if pending:
+            pending.add(self.hedge_executor.submit(self.routed_call, alternate, self.provider.generate,
+                                                   prompt, generation_config))
+        
+        error = None
+        while done or pending:
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                if result is not None:
+                    # The slower request finishes in the background and only feeds the histograms
+                    return result
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        if error is not None:
+            raise error
+        return None
+    
+    def stream_text(self, prompt, progress_callback, stop_on_pass=False, generation_config=None, model=None):
+        """Stream a reply to progress_callback and return the full text (None if empty)"""
+        result = ""
+        try:
+            for fragment in self.provider.stream_generate(prompt, generation_config, model):
+                result += fragment
+                progress_callback(fragment)
+                # A passing verdict has nothing after it worth waiting for
+                if stop_on_pass and stream_verdict(result) is True:
+                    if result.lstrip().startswith("{"):
+                        result = PASS_REPLY
+                    break
+        except (TaskCancelled, APIError):
+            raise
+        except Exception as e:
+            # Fragments were already delivered, so a retry would repeat them
+            if result:
+                raise RuntimeError(f"Gemini stream interrupted: {e}") from e
+            raise
+        return result or None
+    
+    def call_gemini_api(self, prompt, progress_callback=None, stop_on_pass=False, schema=VALIDATION_SCHEMA,
+                        task="validate"):
+        """Return the structured Gemini reply as a GeminiResult; with progress_callback, stream raw fragments"""
+        generation_config = None
+        if schema is not None:
+            generation_config = {"responseMimeType": "application/json", "responseSchema": schema}
+        try:
+            reply = self.generate_text(prompt, progress_callback, stop_on_pass, generation_config, task)
+            if reply is None:
+                return GeminiResult.failure("Unable to get a valid response from Gemini.")
+            with TRACER.span("response.parse", reply_chars=len(reply)):
+                return GeminiResult.parse(reply)
+        except TaskCancelled:
+            raise
+        except Exception as e:
+            return GeminiResult.failure(str(e))
+    
+    def parse_refined_content(self, refined, original_html):
+        """Split a refinement result into (subject, body_text, body_html)"""
+        if refined.error is not None:
+            raise RuntimeError(refined.error)
+        if refined.body:
+            with TRACER.span("refine.text_to_html", chars=len(refined.body)):
+                body_html = self.text_to_html(refined.body, original_html)
+            return refined.subject or "Refined Subject", refined.body, body_html
+        
+        # Fallback if format is not as expected
+        return "Refined Subject", refined.raw, f"<p>{html_lib.escape(refined.raw)}</p>"
+
+    def text_to_html(self, text, original_html):
+        """Convert plain text to escaped HTML in one pass: paragraphs, line breaks and nested bullet/numbered lists"""
+        parts = []
+        paragraph = []
+        # Open lists as (indent, tag), innermost last; each open list has an open <li>
+        lists = []
+        
+        # Escaping never touches the list markers, so the whole text is escaped once up front
+        for line in html_lib.escape(text, quote=False).splitlines():
+            stripped = line.strip()
+            if not stripped:
+                # A blank line ends the paragraph and any lists
+                if paragraph:
+                    parts.append("<p>" + "<br>".join(paragraph) + "</p>")
+                    paragraph = []
+                while lists:
+                    parts.append(f"</li></{lists.pop()[1]}>")
+                continue
+            
+            # Only lines starting like a list item need the regex
+            match = LIST_ITEM_PATTERN.match(line) if stripped[0] in LIST_ITEM_STARTS else None
+            if match is None:
+                if lists and line[0] in " \t":
+                    # Indented text continues the current list item
+                    parts.append("<br>" + stripped)
+                    continue
+                while lists:
+                    parts.append(f"</li></{lists.pop()[1]}>")
+                paragraph.append(stripped)
+                continue
+            
+            if paragraph:
+                parts.append("<p>" + "<br>".join(paragraph) + "</p>")
+                paragraph = []
+            indent = len(match.group('indent').expandtabs(4))
+            number = match.group('number')
+            tag = "ol" if number else "ul"
+            
+            # Close lists nested deeper than this item, then continue, replace or nest
+            while lists and lists[-1][0] > indent:
+                parts.append(f"</li></{lists.pop()[1]}>")
+            if lists and lists[-1][0] == indent and lists[-1][1] != tag:
+                parts.append(f"</li></{lists.pop()[1]}>")
+            if lists and lists[-1][0] == indent:
+                parts.append("</li><li>")
+            else:
+                start = f' start="{int(number)}"' if number and int(number) != 1 else ""
+                parts.append(f"<{tag}{start}><li>")
+                lists.append((indent, tag))
+            parts.append(match.group('content').strip())
+        
+        if paragraph:
+            parts.append("<p>" + "<br>".join(paragraph) + "</p>")
+        while lists:
+            parts.append(f"</li></{lists.pop()[1]}>")
+        return "".join(parts)
+    
+    def validate(self, recipient, subject, plain_body, attachments):
+        """Validate a draft; local rule failures skip Gemini entirely"""
+        with TRACER.span("validate"):
+            with TRACER.span("validate.local"):
+                issues = self.local_validator.check(recipient, subject, plain_body, attachments)
+            if issues:
+                return GeminiResult.from_issues(issues)
+            return self.validate_semantic(recipient, subject, plain_body, attachments)
+    
+    def refine_result(self, recipient, subject, plain_body, validation=None, progress_callback=None):
+        """Refine a draft, using the validation issues when it failed"""
+        with TRACER.span("prompt.build", kind="refine"):
+            if validation is not None and not validation.passed and validation.issues:
+                feedback = "\n".join(f"- {issue}" for issue in validation.issues)
+                prompt = self.create_full_refinement_prompt(recipient, subject, plain_body, feedback)
+            else:
+                prompt = self.create_minimal_refinement_prompt(recipient, subject, plain_body)
+        return self.call_gemini_api(prompt, progress_callback, schema=REFINEMENT_SCHEMA, task="refine")
+    
+    def refine(self, recipient, subject, plain_body, validation=None, original_html=""):
+        """Refine a draft and return (subject, body_text, body_html)"""
+        refined = self.refine_result(recipient, subject, plain_body, validation)
+        return self.parse_refined_content(refined, original_html)
+    
+    def create_combined_prompt(self, recipient, subject, plain_body, attachments, known_issues=()):
+        known = ""
+        if known_issues:
+            known = "These issues were already found and must be reported and fixed:\n" + \
+                "\n".join(f"- {issue}" for issue in known_issues) + "\n"
+        return COMBINED_PROMPT.format(
+            recipient=recipient.strip(),
+            subject=collapse_whitespace(subject),
+            body=collapse_whitespace(plain_body),
+            attachments=attachment_names(attachments),
+            known_issues=known)
+    
+    def validate_and_refine(self, recipient, subject, plain_body, attachments):
+        """Verdict, issues and refined subject/body from a single structured Gemini call"""
+        known_issues = self.local_validator.check(recipient, subject, plain_body, attachments)
+        with TRACER.span("prompt.build", kind="combined"):
+            prompt = self.create_combined_prompt(recipient, subject, plain_body, attachments, known_issues)
+        result = self.call_gemini_api(prompt, schema=RESULT_SCHEMA, task="combined")
+        if result.error is not None:
+            return result
+        
+        issues = list(known_issues) + [issue for issue in result.issues if issue not in known_issues]
+        passed = result.verdict == "yes" and not issues
+        return GeminiResult("yes" if passed else "not ok", issues,
+                            result.subject or subject, result.body or plain_body, raw=result.raw)
+    
+    def close(self):
+        if self.hedge_executor is not None:
+            self.hedge_executor.shutdown(wait=False)
+        self.provider.close()
+        self.response_cache.close()
+
+def message_to_draft(msg, draft_id):
+    """Turn an email.message.Message into a draft dict"""
+    plain_body = None
+    html_body = None
+    attachments = []
+    for part in msg.walk():
+        if part.is_multipart():
+            continue
+        if part.get_filename():
+            attachments.append(part.get_filename())
+            continue
+        payload = part.get_payload(decode=True) or b""
+        text = payload.decode(part.get_content_charset() or "utf-8", errors="replace")
+        if part.get_content_type() == "text/plain" and plain_body is None:
+            plain_body = text
+        elif part.get_content_type() == "text/html" and html_body is None:
+            html_body = text
+    if plain_body is None:
+        # Crude tag strip is enough to give the model readable text
+        plain_body = html_lib.unescape(re.sub(r"<[^>]+>", "", html_body or ""))
+    return {
+        'id': str(msg.get('Message-ID') or draft_id),
+        'to': str(msg.get('To', '')),
+        'subject': str(msg.get('Subject', '')),
+        'body': plain_body.strip(),
+        'attachments': attachments,
+    }
+
+def load_drafts(path):
+    """Yield drafts from a directory (.eml/.json files), an mbox file or a JSONL file"""
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            file_path = os.path.join(path, name)
+            if name.endswith(".eml"):
+                with open(file_path, 'rb') as file:
+                    yield message_to_draft(message_from_binary_file(file, policy=email.policy.default), name)
+            elif name.endswith(".json"):
+                with open(file_path, encoding="utf-8") as file:
+                    draft = json.load(file)
+                draft.setdefault('id', name)
+                yield draft
+    elif path.endswith(".jsonl"):
+        with open(path, encoding="utf-8") as file:
+            for line_number, line in enumerate(file, 1):
+                if line.strip():
+                    draft = json.loads(line)
+                    draft.setdefault('id', str(line_number))
+                    yield draft
+    else:
+        import mailbox
+        # The default policy decodes RFC 2047 and raw 8-bit headers to str (compat32 gives Header objects)
+        factory = lambda file: message_from_binary_file(file, policy=email.policy.default)
+        for index, msg in enumerate(mailbox.mbox(path, factory=factory, create=False)):
+            yield message_to_draft(msg, str(index))
+
+def process_draft(engine, draft, refine=False, combined=False, validation=None):
+    """Validate (and optionally refine) one draft; returns a JSON-serialisable result
+
+    A validation already obtained for the draft (see process_draft_batch) is used instead of a new call.
+    """
+    recipient = draft.get('to', '')
+    subject = draft.get('subject', '')
+    body = draft.get('body', '')
+    attachments = draft.get('attachments') or []
+    result = {'id': draft.get('id'), 'to': recipient, 'subject': subject}
+    try:
+        if combined:
+            outcome = engine.validate_and_refine(recipient, subject, body, attachments)
+        elif validation is not None:
+            outcome = validation
+        else:
+            outcome = engine.validate(recipient, subject, body, attachments)
+        if outcome.error is not None:
+            raise RuntimeError(outcome.error)
+        result['verdict'] = "ok" if outcome.passed else "not ok"
+        result['validation'] = outcome.to_text()
+        result['issues'] = outcome.issues
+        if combined:
+            result['refined_subject'] = outcome.subject
+            result['refined_body'] = outcome.body
+        elif refine:
+            refined_subject, refined_body, _ = engine.refine(recipient, subject, body, outcome)
+            result['refined_subject'] = refined_subject
+            result['refined_body'] = refined_body
+    except Exception as e:
+        result['verdict'] = "error"
+        result['error'] = str(e)
+    return result
+
+def process_draft_batch(engine, drafts, refine=False, combined=False):
+    """Validate a group of drafts with batched requests, then refine them one by one if asked"""
+    if combined:
+        return [process_draft(engine, draft, combined=True) for draft in drafts]
+    try:
+        validations = engine.validate_many(drafts)
+    except Exception as e:
+        validations = [GeminiResult.failure(str(e))] * len(drafts)
+    return [process_draft(engine, draft, refine, validation=validation)
+            for draft, validation in zip(drafts, validations)]
+
+def iter_groups(items, size):
+    """Yield lists of up to size consecutive items"""
+    import itertools
+    iterator = iter(items)
+    while True:
+        group = list(itertools.islice(iterator, size))
+        if not group:
+            return
+        yield group
+
+def batch_main(argv):
+    """Headless entry point: validate a set of drafts concurrently and write the results as JSONL"""
+    import argparse
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    
+    parser = argparse.ArgumentParser(prog="email_composer.py batch",
+                                     description="Validate drafts with Gemini without starting the GUI.")
+    parser.add_argument("input", help="directory of .eml/.json drafts, an mbox file or a .jsonl file")
+    parser.add_argument("-o", "--output", default="-", help="JSONL output file (default: stdout)")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="concurrent requests (default: 4)")
+    parser.add_argument("-r", "--rate", type=float, default=60.0,
+                        help="maximum Gemini requests per minute, 0 for unlimited (default: 60)")
+    parser.add_argument("--retries", type=int, default=4,
+                        help="retries of rate-limited or failed requests (default: 4)")
+    parser.add_argument("--refine", action="store_true", help="also refine each draft")
+    parser.add_argument("--combined", action="store_true",
+                        help="validate and refine each draft with a single structured request")
+    parser.add_argument("--provider", choices=["gemini", "local"], default="gemini",
+                        help="model backend: the Gemini API or a local OpenAI-compatible server (default: gemini)")
+    parser.add_argument("--api-key", default=os.environ.get("GEMINI_API_KEY"),
+                        help="Gemini API key (default: $GEMINI_API_KEY)")
+    parser.add_argument("--base-url", default=None,
+                        help="override the API base URL (local default: http://127.0.0.1:8080/v1)")
+    parser.add_argument("--local-model", default=None, help="model name sent to the local server")
+    parser.add_argument("--validation-model", default=None, help="model for validation (default: gemini-2.0-flash-lite)")
+    parser.add_argument("--refinement-model", default=None,
+                        help="model for refinement and --combined (default: gemini-2.0-flash)")
+    parser.add_argument("--hedge", action="store_true",
+                        help="also ask the fallback model when a request is slower than its p95 latency")
+    parser.add_argument("--trace", default=None, help="append a JSONL span log of every stage to this file")
+    parser.add_argument("--micro-batch", type=int, default=0,
+                        help="validate up to this many drafts per request, adapting to latency (default: off)")
+    parser.add_argument("--token-budget", type=int, default=8000,
+                        help="estimated prompt tokens above which a body is validated in chunks (default: 8000)")
+    args = parser.parse_args(argv)
+    
+    if args.provider == "gemini" and not args.api_key:
+        parser.error("a Gemini API key is required (--api-key or GEMINI_API_KEY)")
+    
+    provider = create_provider(args.provider, args.api_key if args.provider == "gemini" else None,
+                               args.base_url, args.local_model)
+    engine = EmailEngine(args.api_key, cache_path=os.path.join(APP_DATA_DIR, "response_cache.sqlite3"),
+                         provider=provider)
+    engine.max_prompt_tokens = args.token_budget
+    TRACER.log_path = args.trace
+    group_size = max(1, args.micro_batch)
+    engine.batch_sizer = BatchSizer(initial=min(4, group_size), maximum=group_size)
+    engine.governor = RequestGovernor(per_minute=args.rate or None, max_retries=args.retries)
+    if args.validation_model:
+        engine.router.routes["validate"] = args.validation_model
+    if args.refinement_model:
+        engine.router.routes["refine"] = engine.router.routes["combined"] = args.refinement_model
+    engine.router.hedging = args.hedge
+    
+    output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    counts = {}
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            futures = [executor.submit(process_draft_batch, engine, group, args.refine, args.combined)
+                       for group in iter_groups(load_drafts(args.input), group_size)]
+            for future in as_completed(futures):
+                for result in future.result():
+                    counts[result['verdict']] = counts.get(result['verdict'], 0) + 1
+                    output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        engine.close()
+    
+    summary = ", ".join(f"{count} {verdict}" for verdict, count in sorted(counts.items()))
+    print(f"Processed {sum(counts.values())} drafts: {summary or 'none'}", file=sys.stderr)
+    stats = engine.governor.stats()
+    print(f"Throttled {stats['throttled']} requests for {stats['throttle_seconds']:.1f}s, "
+          f"{stats['retries']} retries, {stats['rejected']} rejected by the circuit breaker", file=sys.stderr)
+    for model, model_stats in sorted(engine.router.stats().items()):
+        print(f"{model}: {model_stats['calls']} calls, p50 <= {model_stats['p50']:.2f}s, "
+              f"p95 <= {model_stats['p95']:.2f}s, {model_stats['error_rate']:.0%} errors", file=sys.stderr)
+    return 1 if counts.get("error") else 0
@@ -0,0 +1,1639 @@
+#!/usr/bin/env python3
+"""PyQt5 front end of the email composer, built on top of email_core"""
+import os
+import re
+import bisect
+import itertools
+import hashlib
+import html as html_lib
+from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
+                            QHBoxLayout, QLabel, QLineEdit, QPushButton, 
+                            QTextEdit, QToolBar, QAction, QFileDialog, 
+                            QMessageBox, QListWidget, QListWidgetItem, QComboBox,
+                            QFontComboBox, QColorDialog, QDialog, QGridLayout,
+                            QFrame, QSplitter, QProgressBar, QScrollArea,
+                            QSizePolicy, QSpacerItem, QStyle, QStyleFactory,
+                            QGroupBox, QDockWidget, QTableWidget, QTableWidgetItem,
+                            QHeaderView)
+from PyQt5.QtGui import (QIcon, QFont, QColor, QTextCharFormat, QTextCursor, 
+                         QPalette, QPixmap, QTextListFormat, QTextFormat)
+from PyQt5.QtCore import (Qt, QSize, QPropertyAnimation, QEasingCurve, QRect, QTimer,
+                          QObject, QRunnable, QThreadPool, pyqtSignal)
+from email_core import (APP_DATA_DIR, TRACER, TaskCancelled, EmailEngine, SMTPConnectionManager, Outbox,
+                        GeminiResult, VALIDATION_SCHEMA, create_provider, stream_verdict, changed_region_size,
+                        word_diff, LIST_ITEM_PATTERN)
+
+class WorkerSignals(QObject):
+    """Signals used by background workers to report back to the GUI thread"""
+    result = pyqtSignal(int, object)
+    progress = pyqtSignal(int, object)
+    error = pyqtSignal(int, str)
+    finished = pyqtSignal(int)
+
+class OutboxSignals(QObject):
+    """Carries outbox status messages from the sender thread to the GUI thread"""
+    status = pyqtSignal(str)
+
+class Worker(QRunnable):
+    """Runs a blocking call on the thread pool and reports the outcome through signals"""
+    def __init__(self, task_id, fn, *args, **kwargs):
+        super().__init__()
+        self.task_id = task_id
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+        self.cancelled = False
+        
+        # Name of the span that times this task
+        self.name = getattr(fn, '__name__', "task")
+        
+    def cancel(self):
+        # Streaming calls stop at their next progress report; others just have their result dropped
+        self.cancelled = True
+    
+    def report_progress(self, value):
+        if self.cancelled:
+            raise TaskCancelled()
+        self.signals.progress.emit(self.task_id, value)
+        
+    def run(self):
+        try:
+            with TRACER.span(self.name):
+                result = self.fn(*self.args, **self.kwargs)
+        except TaskCancelled:
+            pass
+        except Exception as e:
+            if not self.cancelled:
+                self.signals.error.emit(self.task_id, str(e))
+        else:
+            if not self.cancelled:
+                self.signals.result.emit(self.task_id, result)
+        finally:
+            self.signals.finished.emit(self.task_id)
+
+class DocumentSnapshot:
+    """HTML and plain text of a QTextDocument, serialized on first use and cached until the document changes"""
+    def __init__(self, document):
+        self.document = document
+        self.revision = None
+        self.cached_text = None
+        self.cached_html = None
+        self.cached_digest = None
+        
+        # Format-only edits do not always bump the revision, so every change drops the cache
+        document.contentsChange.connect(self.invalidate)
+    
+    def invalidate(self, *args):
+        self.cached_text = None
+        self.cached_html = None
+        self.cached_digest = None
+    
+    def check_revision(self):
+        revision = self.document.revision()
+        if revision != self.revision:
+            self.invalidate()
+            self.revision = revision
+    
+    def text(self):
+        self.check_revision()
+        if self.cached_text is None:
+            with TRACER.span("gui.to_plain_text"):
+                self.cached_text = self.document.toPlainText()
+        else:
+            TRACER.count("gui.snapshot_hits")
+        return self.cached_text
+    
+    def html(self):
+        self.check_revision()
+        if self.cached_html is None:
+            with TRACER.span("gui.to_html"):
+                self.cached_html = self.document.toHtml()
+        else:
+            TRACER.count("gui.snapshot_hits")
+        return self.cached_html
+    
+    def html_digest(self):
+        """SHA-256 of the HTML, so fingerprints do not re-hash a large document"""
+        html = self.html()
+        if self.cached_digest is None:
+            self.cached_digest = hashlib.sha256(html.encode("utf-8")).hexdigest()
+        return self.cached_digest
+
+class ModernButton(QPushButton):
+    """Custom button with modern styling"""
+    def __init__(self, text, parent=None, primary=False):
+        super().__init__(text, parent)
+        self.primary = primary
+        self.setMinimumHeight(36)
+        self.setCursor(Qt.PointingHandCursor)
+        self.setStyleSheet(self._get_style())
+        
+    def _get_style(self):
+        if self.primary:
+            return """
+                QPushButton {
+                    background-color: #4a86e8;
+                    color: white;
+                    border: none;
+                    border-radius: 4px;
+                    padding: 8px 16px;
+                    font-weight: bold;
+                }
+                QPushButton:hover {
+                    background-color: #3a76d8;
+                }
+                QPushButton:pressed {
+                    background-color: #2a66c8;
+                }
+                QPushButton:disabled {
+                    background-color: #cccccc;
+                    color: #888888;
+                }
+            """
+        else:
+            return """
+                QPushButton {
+                    background-color: #f0f0f0;
+                    color: #333333;
+                    border: 1px solid #cccccc;
+                    border-radius: 4px;
+                    padding: 8px 16px;
+                }
+                QPushButton:hover {
+                    background-color: #e0e0e0;
+                    border: 1px solid #bbbbbb;
+                }
+                QPushButton:pressed {
+                    background-color: #d0d0d0;
+                }
+                QPushButton:disabled {
+                    background-color: #f8f8f8;
+                    color: #bbbbbb;
+                    border: 1px solid #dddddd;
+                }
+            """
+
+class TextFormatButton(QPushButton):
+    """Custom button for text formatting with modern styling"""
+    def __init__(self, text, parent=None):
+        super().__init__(text, parent)
+        self.setMinimumHeight(28)
+        self.setMinimumWidth(80)
+        self.setCursor(Qt.PointingHandCursor)
+        self.setCheckable(True)
+        self.setStyleSheet("""
+            QPushButton {
+                background-color: #f8f8f8;
+                color: #333333;
+                border: 1px solid #dddddd;
+                border-radius: 4px;
+                padding: 4px 8px;
+                font-size: 12px;
+            }
+            QPushButton:hover {
+                background-color: #e8e8e8;
+                border: 1px solid #cccccc;
+            }
+            QPushButton:pressed, QPushButton:checked {
+                background-color: #4a86e8;
+                color: white;
+                border: 1px solid #3a76d8;
+            }
+            QPushButton:disabled {
+                background-color: #f8f8f8;
+                color: #bbbbbb;
+                border: 1px solid #dddddd;
+            }
+        """)
+
+class ModernLineEdit(QLineEdit):
+    """Custom line edit with modern styling"""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setMinimumHeight(36)
+        self.setStyleSheet("""
+            QLineEdit {
+                border: 1px solid #cccccc;
+                border-radius: 4px;
+                padding: 8px;
+                background-color: white;
+            }
+            QLineEdit:focus {
+                border: 1px solid #4a86e8;
+            }
+            QLineEdit:disabled {
+                background-color: #f0f0f0;
+                color: #888888;
+            }
+        """)
+
+class ValidationPanel(QWidget):
+    """Panel to display validation results with integrated action buttons"""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.parent = parent
+        
+        # Main layout
+        self.layout = QVBoxLayout(self)
+        self.layout.setContentsMargins(12, 12, 12, 12)
+        self.layout.setSpacing(10)
+        
+        # Title
+        title_label = QLabel("Validation Results")
+        title_label.setStyleSheet("""
+            font-size: 16px;
+            font-weight: bold;
+            color: #4a86e8;
+            padding-bottom: 8px;
+        """)
+        self.layout.addWidget(title_label)
+        
+        # Result area
+        self.result_area = QTextEdit()
+        self.result_area.setReadOnly(True)
+        self.result_area.setMinimumHeight(150)
+        self.result_area.setStyleSheet("""
+            QTextEdit {
+                border: 1px solid #dddddd;
+                border-radius: 4px;
+                background-color: white;
+                padding: 8px;
+            }
+        """)
+        self.layout.addWidget(self.result_area)
+        
+        # Action buttons (initially hidden)
+        self.action_frame = QFrame()
+        self.action_frame.setVisible(False)
+        self.action_layout = QHBoxLayout(self.action_frame)
+        self.action_layout.setContentsMargins(0, 0, 0, 0)
+        
+        self.edit_button = ModernButton("Edit Email", primary=False)
+        self.edit_button.setIcon(QApplication.style().standardIcon(QStyle.SP_DialogResetButton))
+        self.edit_button.clicked.connect(self.on_edit)
+        
+        self.send_button = ModernButton("Send Anyway", primary=True)
+        self.send_button.setIcon(QApplication.style().standardIcon(QStyle.SP_DialogApplyButton))
+        self.send_button.clicked.connect(self.on_send)
+        
+        self.abort_button = ModernButton("Abort", primary=False)
+        self.abort_button.setIcon(QApplication.style().standardIcon(QStyle.SP_DialogCancelButton))
+        self.abort_button.clicked.connect(self.on_abort)
+        
+        self.action_layout.addWidget(self.edit_button)
+        self.action_layout.addWidget(self.send_button)
+        self.action_layout.addWidget(self.abort_button)
+        
+        self.layout.addWidget(self.action_frame)
+        
+        # Refine button (initially hidden)
+        self.refine_button = ModernButton("Refine Email", primary=True)
+        self.refine_button.clicked.connect(self.on_refine)
+        self.refine_button.setVisible(False)
+        self.layout.addWidget(self.refine_button)
+        
+    def set_result(self, result):
+        self.result_area.setHtml(result)
+    
+    def show_actions(self, show=True):
+        self.action_frame.setVisible(show)
+        
+    def show_refine_button(self, show=True):
+        self.refine_button.setVisible(show)
+        
+    def on_edit(self):
+        self.show_actions(False)
+        # Just continue editing
+        
+    def on_send(self):
+        self.show_actions(False)
+        self.parent.send_email()
+        
+    def on_abort(self):
+        self.show_actions(False)
+        self.parent.clear_form()
+        
+    def on_refine(self):
+        self.parent.refine_email()
+
+class RefinedContentPanel(QWidget):
+    """Panel to display refined email content with insert button"""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.parent = parent
+        
+        # Main layout
+        self.layout = QVBoxLayout(self)
+        self.layout.setContentsMargins(12, 12, 12, 12)
+        self.layout.setSpacing(10)
+        
+        # Title
+        title_label = QLabel("Refined Email Content")
+        title_label.setStyleSheet("""
+            font-size: 16px;
+            font-weight: bold;
+            color: #4a86e8;
+            padding-bottom: 8px;
+        """)
+        self.layout.addWidget(title_label)
+        
+        # Content area
+        self.content_area = QTextEdit()
+        self.content_area.setReadOnly(True)
+        self.content_area.setMinimumHeight(150)
+        self.content_area.setStyleSheet("""
+            QTextEdit {
+                border: 1px solid #b0d0ff;
+                border-radius: 4px;
+                background-color: white;
+                padding: 8px;
+            }
+        """)
+        self.layout.addWidget(self.content_area)
+        
+        # Insert button
+        self.insert_button = ModernButton("Insert Refined Content", primary=True)
+        self.insert_button.clicked.connect(self.on_insert)
+        self.layout.addWidget(self.insert_button)
+        
+        # Initially hide this panel
+        self.setVisible(False)
+        
+    def set_content(self, content):
+        self.content_area.setHtml(content)
+    
+    def on_insert(self):
+        self.parent.insert_refined_content()
+
+class AttachmentPanel(QFrame):
+    """Compact attachment panel with modern styling"""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.parent = parent
+        self.setFrameShape(QFrame.StyledPanel)
+        self.setFrameShadow(QFrame.Raised)
+        self.setMaximumHeight(120)
+        self.setStyleSheet("""
+            AttachmentPanel {
+                background-color: #f8f8f8;
+                border: 1px solid #dddddd;
+                border-radius: 4px;
+            }
+        """)
+        
+        self.layout = QVBoxLayout(self)
+        self.layout.setContentsMargins(8, 8, 8, 8)
+        
+        # Header with label and buttons
+        header_layout = QHBoxLayout()
+        
+        attachment_label = QLabel("Attachments:")
+        attachment_label.setStyleSheet("font-weight: bold;")
+        header_layout.addWidget(attachment_label)
+        
+        header_layout.addStretch()
+        
+        add_btn = ModernButton("Add", primary=False)
+        add_btn.setIcon(QApplication.style().standardIcon(QStyle.SP_FileDialogNewFolder))
+        add_btn.setToolTip("Add attachment")
+        add_btn.clicked.connect(self.parent.add_attachment)
+        add_btn.setMaximumWidth(80)
+        
+        remove_btn = ModernButton("Remove", primary=False)
+        remove_btn.setIcon(QApplication.style().standardIcon(QStyle.SP_TrashIcon))
+        remove_btn.setToolTip("Remove selected attachment")
+        remove_btn.clicked.connect(self.parent.remove_attachment)
+        remove_btn.setMaximumWidth(80)
+        
+        header_layout.addWidget(add_btn)
+        header_layout.addWidget(remove_btn)
+        
+        self.layout.addLayout(header_layout)
+        
+        # Attachment list
+        self.attachment_list = QListWidget()
+        self.attachment_list.setMaximumHeight(60)
+        self.attachment_list.setStyleSheet("""
+            QListWidget {
+                border: 1px solid #dddddd;
+                border-radius: 4px;
+                background-color: white;
+            }
+            QListWidget::item {
+                padding: 4px;
+            }
+            QListWidget::item:selected {
+                background-color: #e0e0e0;
+                color: #333333;
+            }
+        """)
+        self.layout.addWidget(self.attachment_list)
+
+class CompositionPanel(QWidget):
+    """Panel for email composition"""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.parent = parent
+        
+        # Main layout
+        self.layout = QVBoxLayout(self)
+        self.layout.setContentsMargins(16, 16, 16, 16)
+        self.layout.setSpacing(12)
+        
+        # Header with app title
+        header_label = QLabel("Email Composer")
+        header_label.setStyleSheet("""
+            font-size: 18px;
+            font-weight: bold;
+            color: #4a86e8;
+            padding-bottom: 8px;
+            border-bottom: 1px solid #dddddd;
+        """)
+        self.layout.addWidget(header_label)
+        
+        # Recipient section
+        recipient_layout = QHBoxLayout()
+        recipient_label = QLabel("To:")
+        recipient_label.setMinimumWidth(60)
+        self.recipient_input = ModernLineEdit()
+        recipient_layout.addWidget(recipient_label)
+        recipient_layout.addWidget(self.recipient_input)
+        self.layout.addLayout(recipient_layout)
+        
+        # Subject section
+        subject_layout = QHBoxLayout()
+        subject_label = QLabel("Subject:")
+        subject_label.setMinimumWidth(60)
+        self.subject_input = ModernLineEdit()
+        subject_layout.addWidget(subject_label)
+        subject_layout.addWidget(self.subject_input)
+        self.layout.addLayout(subject_layout)
+        
+        # Create formatting toolbar
+        self.create_formatting_toolbar()
+        
+        # Text editor
+        self.text_editor = QTextEdit()
+        self.text_editor.setMinimumHeight(250)
+        self.text_editor.setStyleSheet("""
+            QTextEdit {
+                border: 1px solid #cccccc;
+                border-radius: 4px;
+                padding: 8px;
+                background-color: white;
+            }
+            QTextEdit:focus {
+                border: 1px solid #4a86e8;
+            }
+        """)
+        self.layout.addWidget(self.text_editor)
+        
+        # Attachments panel (compact)
+        self.attachment_panel = AttachmentPanel(self.parent)
+        self.layout.addWidget(self.attachment_panel)
+        
+        # Action buttons
+        action_layout = QHBoxLayout()
+        
+        # Add spacer to push buttons to the right
+        action_layout.addStretch()
+        
+        self.live_check_button = TextFormatButton("Live Check")
+        self.live_check_button.setToolTip("Validate automatically while typing")
+        self.live_check_button.setMinimumHeight(36)
+        self.live_check_button.toggled.connect(self.parent.toggle_live_validation)
+        action_layout.addWidget(self.live_check_button)
+        
+        validate_btn = ModernButton("Validate with Gemini", primary=True)
+        validate_btn.setIcon(QApplication.style().standardIcon(QStyle.SP_DialogApplyButton))
+        validate_btn.clicked.connect(self.parent.validate_email)
+        validate_btn.setMinimumWidth(180)
+        action_layout.addWidget(validate_btn)
+        
+        combined_btn = ModernButton("Validate + Refine", primary=False)
+        combined_btn.setToolTip("Validate and refine with a single Gemini request")
+        combined_btn.clicked.connect(self.parent.validate_and_refine_email)
+        combined_btn.setMinimumWidth(150)
+        action_layout.addWidget(combined_btn)
+        
+        send_btn = ModernButton("Send Email", primary=True)
+        send_btn.setIcon(QApplication.style().standardIcon(QStyle.SP_CommandLink))
+        send_btn.clicked.connect(self.parent.confirm_send)
+        send_btn.setMinimumWidth(150)
+        action_layout.addWidget(send_btn)
+        
+        self.layout.addLayout(action_layout)
+        
+    def create_formatting_toolbar(self):
+        # Create toolbar with modern styling
+        self.formatting_toolbar = QToolBar("Formatting")
+        self.formatting_toolbar.setMovable(False)
+        self.formatting_toolbar.setStyleSheet("""
+            QToolBar {
+                background-color: #f8f8f8;
+                border: 1px solid #dddddd;
+                border-radius: 4px;
+                spacing: 4px;
+                padding: 4px;
+            }
+        """)
+        self.parent.addToolBar(self.formatting_toolbar)
+        
+        # Font family
+        font_family_label = QLabel("Font:")
+        font_family_label.setStyleSheet("padding-left: 4px; padding-right: 4px;")
+        self.formatting_toolbar.addWidget(font_family_label)
+        
+        self.font_family = QFontComboBox()
+        self.font_family.setMaximumWidth(150)
+        self.font_family.currentFontChanged.connect(self.parent.change_font_family)
+        self.formatting_toolbar.addWidget(self.font_family)
+        
+        # Font size
+        font_size_label = QLabel("Size:")
+        font_size_label.setStyleSheet("padding-left: 8px; padding-right: 4px;")
+        self.formatting_toolbar.addWidget(font_size_label)
+        
+        self.font_size = QComboBox()
+        self.font_size.setMaximumWidth(60)
+        font_sizes = ['8', '9', '10', '11', '12', '14', '16', '18', '20', '22', '24', '26', '28', '36', '48', '72']
+        self.font_size.addItems(font_sizes)
+        self.font_size.setCurrentText('12')
+        self.font_size.currentTextChanged.connect(self.parent.change_font_size)
+        self.formatting_toolbar.addWidget(self.font_size)
+        
+        self.formatting_toolbar.addSeparator()
+        
+        # Text style buttons
+        self.bold_button = TextFormatButton("Bold")
+        self.bold_button.setToolTip("Bold (Ctrl+B)")
+        self.bold_button.clicked.connect(self.parent.toggle_bold)
+        self.formatting_toolbar.addWidget(self.bold_button)
+        
+        self.italic_button = TextFormatButton("Italic")
+        self.italic_button.setToolTip("Italic (Ctrl+I)")
+        self.italic_button.clicked.connect(self.parent.toggle_italic)
+        self.formatting_toolbar.addWidget(self.italic_button)
+        
+        self.underline_button = TextFormatButton("Underline")
+        self.underline_button.setToolTip("Underline (Ctrl+U)")
+        self.underline_button.clicked.connect(self.parent.toggle_underline)
+        self.formatting_toolbar.addWidget(self.underline_button)
+        
+        self.formatting_toolbar.addSeparator()
+        
+        # Color buttons
+        self.text_color_button = TextFormatButton("Text Color")
+        self.text_color_button.setToolTip("Change text color")
+        self.text_color_button.clicked.connect(self.parent.change_text_color)
+        self.formatting_toolbar.addWidget(self.text_color_button)
+        
+        self.bg_color_button = TextFormatButton("Highlight")
+        self.bg_color_button.setToolTip("Change background color")
+        self.bg_color_button.clicked.connect(self.parent.change_background_color)
+        self.formatting_toolbar.addWidget(self.bg_color_button)
+        
+        self.formatting_toolbar.addSeparator()
+        
+        # Alignment buttons
+        self.align_left_button = TextFormatButton("Left")
+        self.align_left_button.setToolTip("Align text left")
+        self.align_left_button.clicked.connect(lambda: self.parent.text_editor.setAlignment(Qt.AlignLeft))
+        self.formatting_toolbar.addWidget(self.align_left_button)
+        
+        self.align_center_button = TextFormatButton("Center")
+        self.align_center_button.setToolTip("Align text center")
+        self.align_center_button.clicked.connect(lambda: self.parent.text_editor.setAlignment(Qt.AlignCenter))
+        self.formatting_toolbar.addWidget(self.align_center_button)
+        
+        self.align_right_button = TextFormatButton("Right")
+        self.align_right_button.setToolTip("Align text right")
+        self.align_right_button.clicked.connect(lambda: self.parent.text_editor.setAlignment(Qt.AlignRight))
+        self.formatting_toolbar.addWidget(self.align_right_button)
+        
+        self.align_justify_button = TextFormatButton("Justify")
+        self.align_justify_button.setToolTip("Justify text")
+        self.align_justify_button.clicked.connect(lambda: self.parent.text_editor.setAlignment(Qt.AlignJustify))
+        self.formatting_toolbar.addWidget(self.align_justify_button)
+        
+        self.formatting_toolbar.addSeparator()
+        
+        # List buttons
+        self.bullet_list_button = TextFormatButton("Bullet List")
+        self.bullet_list_button.setToolTip("Insert bullet list")
+        self.bullet_list_button.clicked.connect(self.parent.insert_bullet_list)
+        self.formatting_toolbar.addWidget(self.bullet_list_button)
+        
+        self.numbered_list_button = TextFormatButton("Numbered")
+        self.numbered_list_button.setToolTip("Insert numbered list")
+        self.numbered_list_button.clicked.connect(self.parent.insert_numbered_list)
+        self.formatting_toolbar.addWidget(self.numbered_list_button)
+
+class DiagnosticsPanel(QDockWidget):
+    """Dockable table of recent per-stage latencies and counters from the tracer"""
+    COLUMNS = ["Stage", "Count", "Errors", "Last ms", "p50 ms", "p95 ms"]
+    
+    def __init__(self, parent=None):
+        super().__init__("Diagnostics", parent)
+        self.setObjectName("diagnostics")
+        
+        container = QWidget()
+        layout = QVBoxLayout(container)
+        layout.setContentsMargins(8, 8, 8, 8)
+        
+        # Per-stage timings
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        layout.addWidget(self.table)
+        
+        # Counters (cache hits, retries, reused connections, ...)
+        self.counters_label = QLabel("")
+        self.counters_label.setWordWrap(True)
+        self.counters_label.setStyleSheet("color: #555555;")
+        layout.addWidget(self.counters_label)
+        
+        self.setWidget(container)
+        
+        # Refresh only while the panel is shown
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(1000)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.visibilityChanged.connect(self.on_visibility_changed)
+    
+    def on_visibility_changed(self, visible):
+        if visible:
+            self.refresh()
+            self.refresh_timer.start()
+        else:
+            self.refresh_timer.stop()
+    
+    def refresh(self):
+        stats = TRACER.stats()
+        stages = sorted(stats['stages'].items())
+        self.table.setRowCount(len(stages))
+        for row, (name, stage) in enumerate(stages):
+            values = [name, stage['count'], stage['errors'], stage['last_ms'], stage['p50_ms'], stage['p95_ms']]
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(str(value))
+                if column:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.table.setItem(row, column, item)
+        counters = sorted(stats['counters'].items())
+        self.counters_label.setText(", ".join(f"{name}: {value}" for name, value in counters) or "No counters yet")
+
+class EmailComposer(QMainWindow):
+    def __init__(self):
+        super().__init__()
+        self.setWindowTitle("Email Composer with Gemini Validation")
+        self.setGeometry(100, 100, 1200, 900)  # Increased window size
+        
+        # Set application style
+        QApplication.setStyle(QStyleFactory.create("Fusion"))
+        
+        # Email credentials
+        self.email = "Your email here"
+        self.password = "App Password Here"
+        
+        # Gemini API key
+        self.api_key = "API KEY HERE"
+        
+        # Model backend: "gemini", or "local" for an OpenAI-compatible server at local_model_url
+        self.model_provider = "gemini"
+        self.local_model_url = "http://127.0.0.1:8080/v1"
+        # Bearer token for the local server, if it needs one (never the Gemini key)
+        self.local_model_key = None
+        
+        # Reusable authenticated SMTP connections
+        self.smtp_manager = SMTPConnectionManager('smtp.gmail.com', 587, self.email, self.password)
+        
+        # Persistent outbox delivered in the background
+        self.outbox_signals = OutboxSignals()
+        self.outbox = Outbox(os.path.join(APP_DATA_DIR, "outbox.sqlite3"), self.smtp_manager,
+                             on_status=self.outbox_signals.status.emit)
+        
+        # Model backend, response cache and prompt handling
+        if self.model_provider == "local":
+            provider = create_provider("local", self.local_model_key, self.local_model_url)
+        else:
+            provider = create_provider(self.model_provider, self.api_key)
+        self.engine = EmailEngine(self.api_key, cache_path=os.path.join(APP_DATA_DIR, "response_cache.sqlite3"),
+                                  provider=provider)
+        self.provider = self.engine.provider
+        
+        # Span log of every validate/refine/send stage, for diagnosing slow sends
+        self.trace_log_path = os.path.join(APP_DATA_DIR, "trace.jsonl")
+        TRACER.log_path = self.trace_log_path
+        self.response_cache = self.engine.response_cache
+        
+        # Stream Gemini output into the panels as it is generated
+        self.streaming_enabled = True
+        
+        # Live validation while typing: local checks on every pause, Gemini only
+        # once enough text has changed since the last Gemini validation
+        self.live_validation_enabled = False
+        self.live_validation_delay = 800
+        self.live_validation_min_change = 40
+        self.live_validated_text = None
+        # Whether the panel currently shows local rule failures rather than a model verdict
+        self.live_showing_local_issues = False
+        
+        # Background execution of Gemini calls
+        self.thread_pool = QThreadPool.globalInstance()
+        self.task_counter = itertools.count(1)
+        self.active_tasks = {}
+        self.current_tasks = {}
+        
+        # Initialize UI
+        self.init_ui()
+        
+        # List to store attachments
+        self.attachments = []
+        
+        # Store refined content
+        self.refined_subject = ""
+        self.refined_body_text = ""
+        self.refined_body_html = ""
+        
+        # Fingerprint and verdict of the most recently validated draft
+        self.last_validation = None
+        
+        # Parsed result of the most recent validation, used as refinement feedback
+        self.last_validation_result = None
+        
+        # Last verdict that came from the model rather than the local rules
+        self.last_model_result = None
+        
+        # Set window icon
+        self.setWindowIcon(QApplication.style().standardIcon(QStyle.SP_MessageBoxInformation))
+        
+        # Start delivering queued mail, including anything left from a previous run
+        self.outbox_signals.status.connect(self.statusBar().showMessage)
+        self.outbox.start()
+        
+    def init_ui(self):
+        # Set application palette for consistent colors
+        palette = QPalette()
+        palette.setColor(QPalette.Window, QColor(248, 248, 248))
+        palette.setColor(QPalette.WindowText, QColor(51, 51, 51))
+        palette.setColor(QPalette.Base, QColor(255, 255, 255))
+        palette.setColor(QPalette.AlternateBase, QColor(240, 240, 240))
+        palette.setColor(QPalette.ToolTipBase, QColor(255, 255, 255))
+        palette.setColor(QPalette.ToolTipText, QColor(51, 51, 51))
+        palette.setColor(QPalette.Text, QColor(51, 51, 51))
+        palette.setColor(QPalette.Button, QColor(240, 240, 240))
+        palette.setColor(QPalette.ButtonText, QColor(51, 51, 51))
+        palette.setColor(QPalette.Highlight, QColor(74, 134, 232))
+        palette.setColor(QPalette.HighlightedText, QColor(255, 255, 255))
+        QApplication.setPalette(palette)
+        
+        # Central widget with margin
+        central_widget = QWidget()
+        central_widget.setContentsMargins(16, 16, 16, 16)
+        self.setCentralWidget(central_widget)
+        
+        # Main layout
+        main_layout = QVBoxLayout(central_widget)
+        main_layout.setContentsMargins(0, 0, 0, 0)
+        main_layout.setSpacing(16)
+        
+        # Create main splitter
+        self.main_splitter = QSplitter(Qt.Vertical)
+        self.main_splitter.setChildrenCollapsible(False)
+        main_layout.addWidget(self.main_splitter)
+        
+        # Top panel - Composition
+        self.composition_panel = CompositionPanel(self)
+        self.main_splitter.addWidget(self.composition_panel)
+        
+        # Bottom panel - Results (with horizontal split)
+        self.results_widget = QWidget()
+        self.results_layout = QHBoxLayout(self.results_widget)
+        self.results_layout.setContentsMargins(0, 0, 0, 0)
+        self.results_layout.setSpacing(16)
+        
+        # Create horizontal splitter for results
+        self.results_splitter = QSplitter(Qt.Horizontal)
+        self.results_splitter.setChildrenCollapsible(False)
+        self.results_layout.addWidget(self.results_splitter)
+        
+        # Left side - Validation results
+        self.validation_panel = ValidationPanel(self)
+        self.results_splitter.addWidget(self.validation_panel)
+        
+        # Right side - Refined content
+        self.refined_panel = RefinedContentPanel(self)
+        self.results_splitter.addWidget(self.refined_panel)
+        
+        # Add results widget to main splitter
+        self.main_splitter.addWidget(self.results_widget)
+        
+        # Set initial splitter sizes (60% top, 40% bottom)
+        self.main_splitter.setSizes([600, 400])
+        self.results_splitter.setSizes([500, 500])
+        
+        # Status bar for notifications
+        self.statusBar().showMessage("Ready")
+        
+        # Progress indicator and cancel button for background Gemini calls
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.setMaximumWidth(160)
+        self.progress_bar.setMaximumHeight(16)
+        self.progress_bar.setTextVisible(False)
+        self.progress_bar.setVisible(False)
+        self.statusBar().addPermanentWidget(self.progress_bar)
+        
+        self.cancel_button = ModernButton("Cancel", primary=False)
+        self.cancel_button.setMinimumHeight(24)
+        self.cancel_button.setToolTip("Cancel the running Gemini request")
+        self.cancel_button.clicked.connect(self.cancel_tasks)
+        self.cancel_button.setVisible(False)
+        self.statusBar().addPermanentWidget(self.cancel_button)
+        
+        # Latency of the most recent Gemini request
+        self.latency_label = QLabel("")
+        self.latency_label.setStyleSheet("color: #888888; padding-right: 8px;")
+        self.statusBar().addPermanentWidget(self.latency_label)
+        
+        # Reference to text editor for convenience
+        self.text_editor = self.composition_panel.text_editor
+        
+        # Cached serializations of the editor, shared by validation, refinement, send and fingerprinting
+        self.document_snapshot = DocumentSnapshot(self.text_editor.document())
+        
+        # Per-stage timings, hidden until toggled with F12
+        self.diagnostics_panel = DiagnosticsPanel(self)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.diagnostics_panel)
+        self.diagnostics_panel.setVisible(False)
+        toggle_diagnostics = self.diagnostics_panel.toggleViewAction()
+        toggle_diagnostics.setShortcut("F12")
+        self.addAction(toggle_diagnostics)
+        
+        # Debounce timer for live validation
+        self.live_timer = QTimer(self)
+        self.live_timer.setSingleShot(True)
+        self.live_timer.setInterval(self.live_validation_delay)
+        self.live_timer.timeout.connect(self.run_live_validation)
+        self.text_editor.textChanged.connect(self.schedule_live_validation)
+        self.composition_panel.recipient_input.textChanged.connect(self.schedule_live_validation)
+        self.composition_panel.subject_input.textChanged.connect(self.schedule_live_validation)
+        
+        # Set tab order for navigation
+        self.setTabOrder(self.composition_panel.recipient_input, self.composition_panel.subject_input)
+        self.setTabOrder(self.composition_panel.subject_input, self.text_editor)
+        
+    def change_font_family(self, font):
+        self.text_editor.setCurrentFont(font)
+        
+    def change_font_size(self, size):
+        self.text_editor.setFontPointSize(float(size))
+        
+    def toggle_bold(self, checked):
+        if checked:
+            self.text_editor.setFontWeight(QFont.Bold)
+        else:
+            self.text_editor.setFontWeight(QFont.Normal)
+            
+    def toggle_italic(self, checked):
+        self.text_editor.setFontItalic(checked)
+        
+    def toggle_underline(self, checked):
+        self.text_editor.setFontUnderline(checked)
+        
+    def change_text_color(self):
+        color = QColorDialog.getColor()
+        if color.isValid():
+            self.text_editor.setTextColor(color)
+            
+    def change_background_color(self):
+        color = QColorDialog.getColor()
+        if color.isValid():
+            cursor = self.text_editor.textCursor()
+            format = QTextCharFormat()
+            format.setBackground(color)
+            cursor.mergeCharFormat(format)
+            self.text_editor.mergeCurrentCharFormat(format)
+    
+    # Fixed bullet list insertion method using QTextListFormat        
+    def insert_bullet_list(self):
+        try:
+            cursor = self.text_editor.textCursor()
+            
+            # Create a list format for bullet points
+            list_format = QTextListFormat()
+            list_format.setStyle(QTextListFormat.ListDisc)
+            list_format.setIndent(1)
+            
+            # Check if we're already in a list
+            current_list = cursor.currentList()
+            
+            if current_list:
+                # We're in a list, so exit it
+                cursor.beginEditBlock()
+                cursor.insertBlock()
+                cursor.endEditBlock()
+            else:
+                # We're not in a list, so create one
+                cursor.beginEditBlock()
+                cursor.createList(list_format)
+                cursor.endEditBlock()
+                
+            self.text_editor.setFocus()
+        except Exception as e:
+            self.show_error(f"Error inserting bullet list: {str(e)}")
+    
+    # Fixed numbered list insertion method using QTextListFormat
+    def insert_numbered_list(self):
+        try:
+            cursor = self.text_editor.textCursor()
+            
+            # Create a list format for numbered list
+            list_format = QTextListFormat()
+            list_format.setStyle(QTextListFormat.ListDecimal)
+            list_format.setIndent(1)
+            
+            # Check if we're already in a list
+            current_list = cursor.currentList()
+            
+            if current_list:
+                # We're in a list, so exit it
+                cursor.beginEditBlock()
+                cursor.insertBlock()
+                cursor.endEditBlock()
+            else:
+                # We're not in a list, so create one
+                cursor.beginEditBlock()
+                cursor.createList(list_format)
+                cursor.endEditBlock()
+                
+            self.text_editor.setFocus()
+        except Exception as e:
+            self.show_error(f"Error inserting numbered list: {str(e)}")
+        
+    def add_attachment(self):
+        try:
+            file_paths, _ = QFileDialog.getOpenFileNames(self, "Select Files to Attach")
+            for file_path in file_paths:
+                if file_path:
+                    file_name = os.path.basename(file_path)
+                    self.attachments.append(file_path)
+                    self.composition_panel.attachment_panel.attachment_list.addItem(file_name)
+        except Exception as e:
+            self.show_error(f"Error adding attachment: {str(e)}")
+    
+    # Fixed attachment removal functionality            
+    def remove_attachment(self):
+        try:
+            selected_items = self.composition_panel.attachment_panel.attachment_list.selectedItems()
+            if not selected_items:
+                return
+                
+            # Process items in reverse order to avoid index shifting issues
+            rows_to_remove = []
+            for item in selected_items:
+                rows_to_remove.append(self.composition_panel.attachment_panel.attachment_list.row(item))
+            
+            # Sort in descending order to remove from bottom to top
+            rows_to_remove.sort(reverse=True)
+            
+            for row in rows_to_remove:
+                self.composition_panel.attachment_panel.attachment_list.takeItem(row)
+                if row < len(self.attachments):
+                    del self.attachments[row]
+                    
+        except Exception as e:
+            self.show_error(f"Error removing attachment: {str(e)}")
+            
+    def run_in_background(self, kind, fn, *args, on_result=None, on_error=None, on_progress=None):
+        """Run fn on the thread pool; only the newest task of each kind may deliver its result
+
+        When on_progress is given, fn receives a progress_callback keyword argument.
+        """
+        # Supersede any task of the same kind that is still running
+        previous = self.current_tasks.get(kind)
+        if previous is not None and previous in self.active_tasks:
+            self.active_tasks[previous].cancel()
+        
+        task_id = next(self.task_counter)
+        worker = Worker(task_id, fn, *args)
+        worker.name = f"task.{kind}"
+        if on_progress is not None:
+            worker.kwargs['progress_callback'] = worker.report_progress
+            worker.signals.progress.connect(
+                lambda tid, value: self.is_current_task(kind, tid) and on_progress(value))
+        worker.signals.result.connect(
+            lambda tid, result: self.on_task_result(kind, tid, result, on_result))
+        worker.signals.error.connect(
+            lambda tid, message: self.on_task_error(kind, tid, message, on_error))
+        worker.signals.finished.connect(self.on_task_finished)
+        
+        self.current_tasks[kind] = task_id
+        self.active_tasks[task_id] = worker
+        self.update_progress_state()
+        self.thread_pool.start(worker)
+        return task_id
+    
+    def is_current_task(self, kind, task_id):
+        return self.current_tasks.get(kind) == task_id
+    
+    def on_task_result(self, kind, task_id, result, callback):
+        # Drop stale responses so they never overwrite a newer request
+        if not self.is_current_task(kind, task_id):
+            return
+        self.current_tasks.pop(kind, None)
+        if callback:
+            callback(result)
+    
+    def on_task_error(self, kind, task_id, message, callback):
+        if not self.is_current_task(kind, task_id):
+            return
+        self.current_tasks.pop(kind, None)
+        if callback:
+            callback(message)
+        else:
+            self.show_error(message)
+    
+    def on_task_finished(self, task_id):
+        self.active_tasks.pop(task_id, None)
+        self.update_progress_state()
+    
+    def cancel_task(self, kind):
+        # Drop a running task of this kind without touching the panels
+        task_id = self.current_tasks.pop(kind, None)
+        worker = self.active_tasks.get(task_id)
+        if worker is not None:
+            worker.cancel()
+        self.update_progress_state()
+    
+    def cancel_tasks(self):
+        try:
+            for task_id in self.current_tasks.values():
+                worker = self.active_tasks.get(task_id)
+                if worker is not None:
+                    worker.cancel()
+            
+            if "validate" in self.current_tasks:
+                self.validation_panel.set_result("<p>Validation cancelled.</p>")
+            if "refine" in self.current_tasks:
+                self.refined_panel.set_content("<p>Refinement cancelled.</p>")
+            
+            self.current_tasks.clear()
+            self.update_progress_state()
+            self.statusBar().showMessage("Request cancelled")
+        except Exception as e:
+            self.show_error(f"Error cancelling request: {str(e)}")
+    
+    def update_progress_state(self):
+        busy = bool(self.current_tasks)
+        self.progress_bar.setVisible(busy)
+        self.cancel_button.setVisible(busy)
+    
+    def update_latency_label(self):
+        last = self.provider.last_latency()
+        average = self.provider.average_latency()
+        cache = self.response_cache.stats()
+        text = f"Cache: {cache['hits']} hits / {cache['misses']} misses"
+        if last is not None:
+            text = f"Gemini: {last * 1000:.0f} ms (avg {average * 1000:.0f} ms) | " + text
+        governor = self.engine.governor.stats()
+        if governor['retries'] or governor['throttled']:
+            text += f" | {governor['retries']} retries, {governor['throttled']} throttled"
+        if governor['circuit'] != "closed":
+            text += f" | API circuit {governor['circuit']}"
+        self.latency_label.setText(text)
+            
+    def toggle_live_validation(self, checked):
+        self.live_validation_enabled = checked
+        if checked:
+            self.live_validated_text = None
+            self.schedule_live_validation()
+        else:
+            self.live_timer.stop()
+    
+    def schedule_live_validation(self, *args):
+        # Restart the debounce timer on every edit
+        if self.live_validation_enabled:
+            self.live_timer.start()
+    
+    def run_live_validation(self):
+        try:
+            # Never supersede a validation that is already running (e.g. one gating a send)
+            if "validate" in self.current_tasks:
+                self.live_timer.start()
+                return
+            
+            recipient = self.composition_panel.recipient_input.text()
+            subject = self.composition_panel.subject_input.text()
+            body = self.editor_text()
+            if not (recipient.strip() or subject.strip() or body.strip()):
+                self.validation_panel.result_area.clear()
+                return
+            
+            issues = self.engine.local_validator.check(recipient, subject, body, self.attachments)
+            if issues:
+                self.validation_panel.set_result(GeminiResult.from_issues(issues).to_html())
+                self.validation_panel.show_refine_button(True)
+                self.statusBar().showMessage(f"Live check: {len(issues)} issue(s) found")
+                self.live_showing_local_issues = True
+                return
+            
+            # The local issues are fixed: don't leave them on screen if no new request is made below
+            if self.live_showing_local_issues:
+                self.live_showing_local_issues = False
+                if self.last_model_result is not None:
+                    self.validation_panel.set_result(self.last_model_result.to_html())
+                else:
+                    self.validation_panel.result_area.clear()
+                    self.validation_panel.show_refine_button(False)
+            
+            # Only pay for a Gemini request once the draft has changed enough
+            draft_text = "\n".join([recipient, subject, body])
+            if (self.live_validated_text is not None and
+                    changed_region_size(self.live_validated_text, draft_text) < self.live_validation_min_change):
+                return
+            self.live_validated_text = draft_text
+            self.start_validation(live=True)
+        except Exception as e:
+            self.live_timer.stop()
+            self.show_error(f"Error during live validation: {str(e)}")
+    
+    def editor_text(self):
+        return self.document_snapshot.text()
+    
+    def editor_html(self):
+        return self.document_snapshot.html()
+    
+    def draft_fingerprint(self):
+        """Hash of everything that affects validation: recipient, subject, body HTML and attachments"""
+        parts = [
+            self.composition_panel.recipient_input.text(),
+            self.composition_panel.subject_input.text(),
+            self.document_snapshot.html_digest(),
+        ] + list(self.attachments)
+        return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+    
+    def validate_email(self):
+        self.start_validation()
+    
+    def start_validation(self, on_complete=None, live=False):
+        """Validate the current draft in the background; on_complete receives True if it passed
+
+        A live run only updates the validation result: the refined panel and the send actions stay as they are.
+        """
+        try:
+            # Get email content
+            recipient = self.composition_panel.recipient_input.text()
+            subject = self.composition_panel.subject_input.text()
+            body = self.editor_text()
+            fingerprint = self.draft_fingerprint()
+            
+            if not live:
+                self.validation_panel.show_actions(False)
+                self.validation_panel.show_refine_button(False)
+                self.refined_panel.setVisible(False)
+            
+            # Obvious problems are reported instantly without a Gemini round-trip
+            issues = self.engine.local_validator.check(recipient, subject, body, self.attachments)
+            if issues:
+                self.cancel_task("validate")
+                self.on_validation_result(GeminiResult.from_issues(issues), fingerprint, on_complete, local=True, live=live)
+                return
+            
+            # Show validation in progress
+            self.statusBar().showMessage("Validating email...")
+            self.validation_panel.set_result("<p>Validating with Gemini...</p>")
+            
+            # Call Gemini API in the background, stopping the stream as soon as the draft passes
+            self.streamed_text = ""
+            self.run_in_background("validate", self.validate_with_gemini, recipient, subject, body, list(self.attachments),
+                                   on_result=lambda result: self.on_validation_result(result, fingerprint, on_complete,
+                                                                                      live=live),
+                                   on_error=self.on_validation_error,
+                                   on_progress=self.on_validation_progress if self.streaming_enabled else None)
+        except Exception as e:
+            self.show_error(f"Error during validation: {str(e)}")
+    
+    def on_validation_result(self, result, fingerprint=None, on_complete=None, local=False, live=False):
+        try:
+            # Display validation result
+            self.validation_panel.set_result(result.to_html())
+            self.last_validation_result = result
+            self.live_showing_local_issues = local
+            if not local:
+                self.last_model_result = result
+            
+            # Show appropriate buttons based on validation result
+            passed = result.passed
+            if not passed:
+                if not live:
+                    self.validation_panel.show_actions(True)
+                self.validation_panel.show_refine_button(True)
+                self.statusBar().showMessage("Validation failed. Please review the issues.")
+            else:
+                self.validation_panel.show_refine_button(True)
+                self.statusBar().showMessage("Validation successful!")
+            self.update_latency_label()
+            
+            # Remember the verdict unless the call itself failed
+            if fingerprint is not None and result.error is None:
+                self.last_validation = (fingerprint, passed)
+            
+            if on_complete:
+                on_complete(passed)
+        except Exception as e:
+            self.show_error(f"Error during validation: {str(e)}")
+    
+    def on_validation_progress(self, text):
+        verdict_known = stream_verdict(self.streamed_text) is not None
+        self.streamed_text += text
+        
+        # Re-render the partial reply once the verdict is in; the placeholder stays until then
+        partial = GeminiResult.parse_partial(self.streamed_text)
+        if partial.verdict is not None:
+            self.validation_panel.set_result(partial.to_html())
+        
+        # Surface the verdict as soon as it is known, before the issue list finishes
+        if not verdict_known:
+            verdict = stream_verdict(self.streamed_text)
+            if verdict is False:
+                self.statusBar().showMessage("Validation failed. Receiving issues...")
+            elif verdict is True:
+                self.statusBar().showMessage("Validation successful!")
+    
+    def on_validation_error(self, message):
+        self.validation_panel.set_result(f"<p>Error during validation: {message}</p>")
+        self.show_error(f"Error during validation: {message}")
+    
+    def validate_with_gemini(self, recipient, subject, body, attachments, progress_callback=None):
+        """Runs on the thread pool: semantic validation (chunked for long bodies) as a GeminiResult"""
+        return self.engine.validate_semantic(recipient, subject, body, attachments,
+                                             progress_callback, stop_on_pass=True)
+    
+    def create_validation_prompt(self, recipient, subject, body, attachments):
+        try:
+            # body is the plain-text body of the draft
+            return self.engine.create_validation_prompt(recipient, subject, body, attachments)
+        except Exception as e:
+            self.show_error(f"Error creating validation prompt: {str(e)}")
+            return "Error creating validation prompt"
+        
+    def call_gemini_api(self, prompt, progress_callback=None, stop_on_pass=False, schema=VALIDATION_SCHEMA):
+        return self.engine.call_gemini_api(prompt, progress_callback, stop_on_pass, schema)
+    
+    def refine_email(self):
+        try:
+            # Show refinement in progress
+            self.statusBar().showMessage("Refining email...")
+            self.refined_panel.setVisible(True)
+            self.refined_panel.set_content("<p>Refining with Gemini...</p>")
+            
+            # Get email content
+            recipient = self.composition_panel.recipient_input.text()
+            subject = self.composition_panel.subject_input.text()
+            body_text = self.editor_text()
+            body_html = self.editor_html()
+            
+            # Call Gemini API in the background; the issues of the last validation guide the refinement
+            self.streamed_refinement = ""
+            self.run_in_background("refine", self.engine.refine_result, recipient, subject, body_text,
+                                   self.last_validation_result,
+                                   on_result=lambda refined: self.on_refinement_result(refined, body_html),
+                                   on_error=self.on_refinement_error,
+                                   on_progress=self.on_refinement_progress if self.streaming_enabled else None)
+            
+        except Exception as e:
+            self.show_error(f"Error refining email: {str(e)}")
+            self.refined_panel.set_content(f"<p>Error refining email: {str(e)}</p>")
+    
+    def on_refinement_result(self, refined, body_html):
+        try:
+            # Parse and display refined content
+            self.parse_refined_content(refined, body_html)
+            self.show_refined_content()
+            self.statusBar().showMessage("Email refined successfully!")
+            self.update_latency_label()
+            
+        except Exception as e:
+            self.show_error(f"Error refining email: {str(e)}")
+            self.refined_panel.set_content(f"<p>Error refining email: {str(e)}</p>")
+    
+    def show_refined_content(self):
+        # Display refined content
+        refined_html = f"""
+        <h3>Refined Email</h3>
+        <p><strong>Subject:</strong> {self.refined_subject}</p>
+        <div style="border-top: 1px solid #cccccc; margin: 10px 0;"></div>
+        {self.refined_body_html}
+        """
+        self.refined_panel.setVisible(True)
+        self.refined_panel.set_content(refined_html)
+    
+    def validate_and_refine_email(self):
+        try:
+            # Show progress in both panels
+            self.statusBar().showMessage("Validating and refining email...")
+            self.validation_panel.set_result("<p>Validating with Gemini...</p>")
+            self.validation_panel.show_actions(False)
+            self.validation_panel.show_refine_button(False)
+            self.refined_panel.setVisible(True)
+            self.refined_panel.set_content("<p>Refining with Gemini...</p>")
+            
+            # Get email content
+            recipient = self.composition_panel.recipient_input.text()
+            subject = self.composition_panel.subject_input.text()
+            body_text = self.editor_text()
+            body_html = self.editor_html()
+            fingerprint = self.draft_fingerprint()
+            
+            # One structured request fills both panels; it supersedes separate validate/refine calls
+            self.cancel_task("refine")
+            self.run_in_background("validate", self.engine.validate_and_refine,
+                                   recipient, subject, body_text, list(self.attachments),
+                                   on_result=lambda outcome: self.on_combined_result(outcome, fingerprint, body_html),
+                                   on_error=self.on_combined_error)
+        except Exception as e:
+            self.show_error(f"Error validating and refining email: {str(e)}")
+    
+    def on_combined_result(self, outcome, fingerprint, body_html):
+        try:
+            self.on_validation_result(outcome, fingerprint)
+            if outcome.error is not None:
+                self.refined_panel.set_content(f"<p>Error refining email: {html_lib.escape(outcome.error)}</p>")
+                return
+            
+            self.parse_refined_content(outcome, body_html)
+            self.show_refined_content()
+            self.statusBar().showMessage("Email validated and refined "
+                                         + ("successfully!" if outcome.passed else "- please review the issues."))
+        except Exception as e:
+            self.show_error(f"Error validating and refining email: {str(e)}")
+    
+    def on_combined_error(self, message):
+        self.validation_panel.set_result(f"<p>Error during validation: {message}</p>")
+        self.refined_panel.set_content(f"<p>Error refining email: {message}</p>")
+        self.show_error(f"Error validating and refining email: {message}")
+    
+    def on_refinement_progress(self, text):
+        # Re-render the partial subject and body as they stream in
+        self.streamed_refinement += text
+        partial = GeminiResult.parse_partial(self.streamed_refinement)
+        if partial.subject or partial.body:
+            body = html_lib.escape(partial.body).replace("\n", "<br>")
+            self.refined_panel.set_content(
+                f"<p><strong>Subject:</strong> {html_lib.escape(partial.subject)}</p><p>{body}</p>")
+    
+    def on_refinement_error(self, message):
+        self.show_error(f"Error refining email: {message}")
+        self.refined_panel.set_content(f"<p>Error refining email: {message}</p>")
+    
+    def create_minimal_refinement_prompt(self, recipient, subject, body):
+        return self.engine.create_minimal_refinement_prompt(recipient, subject, body)
+
+    def create_full_refinement_prompt(self, recipient, subject, body, validation_result):
+        return self.engine.create_full_refinement_prompt(recipient, subject, body, validation_result)
+    
+    def parse_refined_content(self, refined, original_html):
+        try:
+            self.refined_subject, self.refined_body_text, self.refined_body_html = \
+                self.engine.parse_refined_content(refined, original_html)
+        except Exception as e:
+            self.show_error(f"Error parsing refined content: {str(e)}")
+            self.refined_subject = "Error in refinement"
+            self.refined_body_html = f"<p>Error parsing refined content: {str(e)}</p>"
+            self.refined_body_text = f"Error parsing refined content: {str(e)}"
+
+    def text_to_html(self, text, original_html):
+        return self.engine.text_to_html(text, original_html)
+    
+    def insert_refined_content(self):
+        try:
+            # Insert refined subject and body into the form
+            self.composition_panel.subject_input.setText(self.refined_subject)
+            
+            # Patch only the changed words so the document keeps its formatting;
+            # an empty editor has no formatting to keep and takes the refined HTML
+            if self.editor_text().strip():
+                self.apply_refined_body(self.refined_body_text)
+            else:
+                self.text_editor.setHtml(self.refined_body_html)
+            
+            # Hide refined content panel
+            self.refined_panel.setVisible(False)
+            
+            self.statusBar().showMessage("Refined content inserted successfully!")
+        except Exception as e:
+            self.show_error(f"Error inserting refined content: {str(e)}")
+            
+    def document_text_view(self):
+        """Editor text with list markers as plain text, and (view_start, position, marker_length) per block"""
+        document = self.text_editor.document()
+        lines = []
+        blocks = []
+        offset = 0
+        block = document.begin()
+        while block.isValid():
+            marker = ""
+            text_list = block.textList()
+            if text_list is not None:
+                if text_list.format().style() in (QTextListFormat.ListDisc, QTextListFormat.ListCircle,
+                                                  QTextListFormat.ListSquare):
+                    marker = "- "
+                else:
+                    marker = f"{text_list.itemNumber(block) + 1}. "
+            # Soft line breaks and non-breaking spaces keep their length, so offsets stay aligned
+            line = marker + block.text().replace("\u2028", "\n").replace("\xa0", " ")
+            blocks.append((offset, block.position(), len(marker)))
+            lines.append(line)
+            offset += len(line) + 1
+            block = block.next()
+        return "\n".join(lines), blocks
+    
+    def refined_body_edits(self, refined_text):
+        """Word-level edits from the editor document to refined_text, as (start, end, replacement) positions"""
+        view_text, blocks = self.document_text_view()
+        # The model separates paragraphs with blank lines; the editor usually does not
+        if not re.search(r"\n[ \t]*\n", view_text):
+            refined_text = re.sub(r"\n[ \t]*\n\s*", "\n", refined_text)
+        starts = [view_start for view_start, position, marker_length in blocks]
+        
+        def to_position(offset):
+            # Offsets inside a list marker map to the start of the item's text
+            view_start, position, marker_length = blocks[bisect.bisect_right(starts, offset) - 1]
+            return position + max(0, offset - view_start - marker_length), offset - view_start < marker_length
+        
+        edits = []
+        for start, end, replacement in word_diff(view_text, refined_text):
+            position, in_marker = to_position(start)
+            end_position = max(position, to_position(end)[0])
+            # List markers belong to the list format, not the text: an edit starting in a marker drops
+            # the marker it retypes, and lines it adds to a list become items of that list
+            in_list = blocks[bisect.bisect_right(starts, start) - 1][2] > 0
+            if in_marker or (in_list and "\n" in replacement):
+                lines = replacement.split("\n")
+                for index, line in enumerate(lines):
+                    match = LIST_ITEM_PATTERN.match(line) if index or in_marker else None
+                    if match:
+                        lines[index] = match.group('content') + line[match.end():]
+                replacement = "\n".join(lines)
+            
+            # Embedded images are never removed: the removed range is split around them
+            removed = view_text[start:end]
+            if "\ufffc" in removed:
+                document = self.text_editor.document()
+                segment_start = position
+                for index in range(position, end_position):
+                    if document.characterAt(index) == "\ufffc":
+                        edits.append((segment_start, index, replacement))
+                        replacement = ""
+                        segment_start = index + 1
+                edits.append((segment_start, end_position, replacement))
+                continue
+            edits.append((position, end_position, replacement))
+        return [edit for edit in edits if edit[0] != edit[1] or edit[2]]
+    
+    def apply_refined_body(self, refined_text):
+        """Apply the refined body as in-place edits in one undo step; unchanged text keeps its formatting"""
+        with TRACER.span("gui.apply_refinement") as span:
+            edits = self.refined_body_edits(refined_text)
+            span.set(edits=len(edits))
+            cursor = QTextCursor(self.text_editor.document())
+            cursor.beginEditBlock()
+            try:
+                # Back to front, so earlier positions stay valid
+                for start, end, replacement in reversed(edits):
+                    cursor.setPosition(start)
+                    if end == start:
+                        cursor.insertText(replacement)
+                        continue
+                    # A replaced word takes the format of its first character
+                    cursor.setPosition(start + 1)
+                    char_format = cursor.charFormat()
+                    cursor.setPosition(start)
+                    cursor.setPosition(end, QTextCursor.KeepAnchor)
+                    if replacement:
+                        cursor.insertText(replacement, char_format)
+                    else:
+                        cursor.removeSelectedText()
+            finally:
+                cursor.endEditBlock()
+            return len(edits)
+    
+    def confirm_send(self):
+        try:
+            # Reuse the last verdict if the draft has not changed since it was validated
+            fingerprint = self.draft_fingerprint()
+            if self.last_validation is not None and self.last_validation[0] == fingerprint:
+                self.on_send_validated(self.last_validation[1], fingerprint)
+            else:
+                self.start_validation(on_complete=lambda passed: self.on_send_validated(passed, fingerprint))
+        except Exception as e:
+            self.show_error(f"Error confirming send: {str(e)}")
+    
+    def on_send_validated(self, passed, fingerprint):
+        try:
+            # The draft changed while it was being validated, so check it again
+            if fingerprint != self.draft_fingerprint():
+                self.confirm_send()
+                return
+            
+            if not passed:
+                # Leave the decision to the Edit / Send Anyway / Abort actions
+                self.validation_panel.show_actions(True)
+                self.statusBar().showMessage("Validation failed. Please review the issues before sending.")
+                return
+            
+            # If validation passes, ask for confirmation
+            msg_box = QMessageBox(self)
+            msg_box.setWindowTitle("Confirm Send")
+            msg_box.setText("Are you ready to send this email?")
+            msg_box.setIcon(QMessageBox.Question)
+            msg_box.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
+            msg_box.setDefaultButton(QMessageBox.No)
+            
+            if msg_box.exec_() == QMessageBox.Yes:
+                self.send_email()
+        except Exception as e:
+            self.show_error(f"Error confirming send: {str(e)}")
+            
+    def send_email(self):
+        try:
+            # Get email content
+            recipient = self.composition_panel.recipient_input.text()
+            subject = self.composition_panel.subject_input.text()
+            body_html = self.editor_html()
+            
+            # Queue the message; the outbox thread delivers it and reports progress
+            with TRACER.span("outbox.enqueue"):
+                self.outbox.enqueue(self.email, recipient, subject, body_html, self.attachments)
+            
+            self.clear_form()
+            self.statusBar().showMessage(f"Email to {recipient} queued for sending ({self.outbox.pending_count()} in outbox)")
+            
+        except Exception as e:
+            self.show_error(f"Failed to queue email: {str(e)}")
+            
+    def clear_form(self):
+        try:
+            if self.current_tasks:
+                self.cancel_tasks()
+            self.composition_panel.recipient_input.clear()
+            self.composition_panel.subject_input.clear()
+            self.text_editor.clear()
+            self.composition_panel.attachment_panel.attachment_list.clear()
+            self.attachments.clear()
+            self.validation_panel.result_area.clear()
+            self.last_validation = None
+            self.last_validation_result = None
+            self.last_model_result = None
+            self.live_showing_local_issues = False
+            self.validation_panel.show_actions(False)
+            self.validation_panel.show_refine_button(False)
+            self.refined_panel.setVisible(False)
+            self.statusBar().showMessage("Form cleared")
+        except Exception as e:
+            self.show_error(f"Error clearing form: {str(e)}")
+    
+    def show_error(self, message):
+        """Display error message with consistent styling"""
+        error_box = QMessageBox(self)
+        error_box.setWindowTitle("Error")
+        error_box.setText(message)
+        error_box.setIcon(QMessageBox.Critical)
+        error_box.setStandardButtons(QMessageBox.Ok)
+        error_box.exec_()
+        self.statusBar().showMessage(f"Error: {message}")
+        
+    def show_success(self, message):
+        """Display success message with consistent styling"""
+        success_box = QMessageBox(self)
+        success_box.setWindowTitle("Success")
+        success_box.setText(message)
+        success_box.setIcon(QMessageBox.Information)
+        success_box.setStandardButtons(QMessageBox.Ok)
+        success_box.exec_()
+        self.statusBar().showMessage(message)
+        
+    def closeEvent(self, event):
+        # Release pooled connections before exiting
+        self.engine.close()
+        self.outbox.close()
+        self.smtp_manager.close()
+        super().closeEvent(event)
+        
+    def keyPressEvent(self, event):
+        # Handle key press events
+        if event.key() == Qt.Key_E:
+            # Just continue editing (default behavior)
+            pass
+        elif event.key() == Qt.Key_A:
+            # Abort
+            self.clear_form()
+        elif event.key() == Qt.Key_Return and (event.modifiers() & Qt.ControlModifier):
+            # Ctrl+Enter to send
+            self.confirm_send()
+        else:
+            super().keyPressEvent(event)
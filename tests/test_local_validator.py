@@ -0,0 +1,56 @@
+"""Regression tests for the deterministic LocalValidator rules.
+
+These rules fail a draft without asking Gemini, so every false positive blocks a send.
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from email_core import LocalValidator
+
+class LocalValidatorTestCase(unittest.TestCase):
+    def issues(self, body):
+        return LocalValidator().check("Bob <bob@example.com>", "Subject", body, [])
+
+class QuoteTests(LocalValidatorTestCase):
+    def test_quote_closing_after_digit(self):
+        for body in ('Please review "Phase 2" by Friday.',
+                     'The report is titled "Q3 2024" this time.',
+                     'He said "see you at 5" and left.'):
+            self.assertEqual(self.issues(body), [], body)
+    
+    def test_inch_marks(self):
+        for body in ('He is 5\'10" tall.', 'A 27" screen would do.', 'She said "I am 5\'10" now".'):
+            self.assertEqual(self.issues(body), [], body)
+    
+    def test_unclosed_quote(self):
+        self.assertEqual(self.issues('He said "hello and left.'), ["Unclosed quotation mark in the body"])
+
+class AttachmentTests(LocalValidatorTestCase):
+    MISSING = ["The email mentions an attachment, but no files are attached"]
+    
+    def test_claims_an_attachment(self):
+        for body in ("I've attached the report.", "Please find the report attached.", "Attached is the invoice.",
+                     "We enclose the signed form.", "I am attaching the slides."):
+            self.assertEqual(self.issues(body), self.MISSING, body)
+    
+    def test_other_uses_of_the_words(self):
+        for body in ("The attachment you sent yesterday did not open.", "Thanks for the attached report.",
+                     "I attach great importance to this.", "No attachment needed.", "An enclosed garden."):
+            self.assertEqual(self.issues(body), [], body)
+    
+    def test_attachment_present(self):
+        issues = LocalValidator().check("bob@example.com", "Report", "I've attached the report.", ["report.pdf"])
+        self.assertEqual(issues, [])
+
+class BracketTests(LocalValidatorTestCase):
+    def test_list_markers(self):
+        self.assertEqual(self.issues("Option A) first\nOption B) second\n1) third"), [])
+    
+    def test_unmatched_bracket(self):
+        self.assertEqual(self.issues("See the notes )."), ["Unmatched ')' in the body"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,25 @@
+"""Tests for trimming quoted reply history and signatures out of the validation prompt."""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from email_core import strip_quoted_history
+
+class StripQuotedHistoryTests(unittest.TestCase):
+    def test_reply_headers(self):
+        for header in ("On Mon, Jan 5, 2026 at 10:00 AM Bob <bob@example.com> wrote:",
+                       "On 1/5/2026, Bob wrote:",
+                       "-----Original Message-----"):
+            self.assertEqual(strip_quoted_history(f"Thanks!\n{header}\n> earlier text"), "Thanks!\n", header)
+    
+    def test_body_lines_that_look_like_headers(self):
+        body = "On reflection, this is what I wrote:\nthe plan stands.\n--\nNext section."
+        self.assertEqual(strip_quoted_history(body), body)
+    
+    def test_signature(self):
+        self.assertEqual(strip_quoted_history("See you soon.\n-- \nBob\nSent from my phone"), "See you soon.\n")
+
+if __name__ == "__main__":
+    unittest.main()